@@ -0,0 +1,92 @@
+"""
+Token budgets per session and per client IP. As spend approaches a budget the
+session degrades in steps (see BUDGET_STEPS in app/main.py) instead of just
+getting cut off.
+"""
+import hashlib
+import secrets
+import time
+
+STEP_NAMES = ("short_history", "small_model", "stop")
+
+# Per-process salt: /stats is public, and unsalted hashes of IPv4 addresses are easy to reverse
+_IP_SALT = secrets.token_bytes(16)
+
+
+def ip_label(ip):
+    """
+    Stands in for a client IP in /stats: stable within this worker, not reversible.
+    """
+    return hashlib.sha256(_IP_SALT + ip.encode()).hexdigest()[:12]
+
+
+def parse_steps(spec):
+    """
+    "0.6:short_history,0.8:small_model,1:stop" -> [(0.6, "short_history"), ...], by threshold.
+    """
+    steps = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        threshold, name = part.split(":")
+        if name.strip() not in STEP_NAMES:
+            raise ValueError(f"Unknown budget step {name!r}, expected one of {STEP_NAMES}")
+        steps.append((float(threshold), name.strip()))
+    return sorted(steps)
+
+
+def active_steps(fraction, steps):
+    """
+    The steps in force at `fraction` of the budget, in order.
+    """
+    return [name for threshold, name in steps if fraction >= threshold]
+
+
+class IpBudgets:
+    """
+    Tokens spent per client IP, in fixed windows of `window` seconds (a new window
+    starts on the first spend after the old one ran out).
+    """
+
+    def __init__(self, limit, window=3600):
+        self.limit = limit
+        self.window = window
+        self.spent = {}  # ip -> [window_started, input_tokens, output_tokens]
+
+    def _prune(self):
+        now = time.time()
+        for ip in [ip for ip, entry in self.spent.items() if now - entry[0] >= self.window]:
+            del self.spent[ip]
+
+    def _entry(self, ip):
+        entry = self.spent.get(ip)
+        if entry is None:
+            # Only a new IP grows the table, so that's when to drop the expired ones
+            self._prune()
+        if entry and time.time() - entry[0] >= self.window:
+            entry = None
+        if entry is None:
+            entry = self.spent[ip] = [time.time(), 0, 0]
+        return entry
+
+    def add(self, ip, input_tokens, output_tokens):
+        entry = self._entry(ip)
+        entry[1] += input_tokens
+        entry[2] += output_tokens
+
+    def used(self, ip):
+        entry = self.spent.get(ip)
+        if not entry or time.time() - entry[0] >= self.window:
+            return 0
+        return entry[1] + entry[2]
+
+    def fraction(self, ip):
+        return self.used(ip) / self.limit if self.limit else 0.0
+
+    def stats(self, top=20):
+        self._prune()
+        busiest = sorted(self.spent.items(), key=lambda kv: kv[1][1] + kv[1][2], reverse=True)[:top]
+        return {
+            ip_label(ip): {"input_tokens": i, "output_tokens": o, "fraction": round((i + o) / self.limit, 3) if self.limit else None}
+            for ip, (_, i, o) in busiest
+        }
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_topic(topic):
+    """
+    "  The French Revolution! " and "the french revolution" should share a cache entry.
+    """
+    topic = re.sub(r"\s+", " ", topic.strip().lower())
+    return topic.strip(" .!?")
+
+
+class LessonCache:
+    """
+    Curriculum + test bank cache keyed by normalized topic.
+
+    Two tiers: an in-memory LRU (per worker) in front of an optional SQLite file
+    (shared by every worker on the box). Each topic keeps up to `variants` lessons,
+    and a topic only starts serving hits once it has all of them, so players
+    don't all get the exact same exam.
+    """
+
+    def __init__(self, path=None, max_topics=256, ttl=7 * 24 * 3600, variants=3):
+        self.max_topics = max_topics
+        self.ttl = ttl
+        self.variants = variants
+        self.memory = OrderedDict()  # topic -> [(created_at, lesson), ...]
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        self.db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")  # several workers write at once
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS lessons ("
+                "topic TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS lessons_topic ON lessons (topic)")
+            self.db.commit()
+        self.lock = threading.Lock()  # get/put run in worker threads, one at a time
+
+    def get(self, topic):
+        """
+        Returns a random cached lesson ({"curriculum": [...], "questions": [...]}) or None.
+        """
+        with self.lock:
+            key = normalize_topic(topic)
+            lessons = self._load(key)
+            if len(lessons) < self.variants:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            if self.db:
+                self.db.execute("UPDATE lessons SET last_used = ? WHERE topic = ?", (time.time(), key))
+                self.db.commit()
+            return random.choice(lessons)[1]
+
+    def put(self, topic, lesson):
+        with self.lock:
+            key = normalize_topic(topic)
+            now = time.time()
+            lessons = self._load(key) + [(now, lesson)]
+            # Keep the newest variants
+            lessons = lessons[-self.variants:]
+            self._remember(key, lessons)
+
+            if self.db:
+                self.db.execute(
+                    "INSERT INTO lessons (topic, created_at, last_used, data) VALUES (?, ?, ?, ?)",
+                    (key, now, now, json.dumps(lesson)),
+                )
+                self.db.execute(
+                    "DELETE FROM lessons WHERE topic = ? AND rowid NOT IN "
+                    "(SELECT rowid FROM lessons WHERE topic = ? ORDER BY created_at DESC LIMIT ?)",
+                    (key, key, self.variants),
+                )
+                self._evict_disk()
+                self.db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "topics_in_memory": len(self.memory),
+        }
+
+    # --- TIERS ---
+
+    def _load(self, key):
+        now = time.time()
+        lessons = []
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            lessons = [(t, l) for t, l in self.memory[key] if now - t < self.ttl]
+            if len(lessons) < len(self.memory[key]):
+                self._remember(key, lessons)
+        if len(lessons) >= self.variants or not self.db:
+            return lessons
+
+        # Other workers may have filled in the variants this one is missing
+        rows = self.db.execute(
+            "SELECT created_at, data FROM lessons WHERE topic = ? AND created_at > ? ORDER BY created_at",
+            (key, now - self.ttl),
+        ).fetchall()
+        if len(rows) <= len(lessons):
+            return lessons
+        lessons = [(t, json.loads(data)) for t, data in rows]
+        self.disk_hits += 1
+        self._remember(key, lessons)
+        return lessons
+
+    def _remember(self, key, lessons):
+        if not lessons:
+            self.memory.pop(key, None)
+            return
+        self.memory[key] = lessons
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_topics:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self):
+        # TTL first, then drop the least recently used topics past the size cap
+        self.db.execute("DELETE FROM lessons WHERE created_at <= ?", (time.time() - self.ttl,))
+        self.db.execute(
+            "DELETE FROM lessons WHERE topic NOT IN "
+            "(SELECT topic FROM lessons GROUP BY topic ORDER BY MAX(last_used) DESC LIMIT ?)",
+            (self.max_topics,),
+        )
+
+
+def response_key(kwargs):
+    """
+    Content address of an LLM request: model + input + output format.
+    """
+    payload = {k: kwargs.get(k) for k in ("model", "input", "text", "max_output_tokens", "reasoning")}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    LLM response text keyed by response_key().
+
+    An in-memory LRU bounded by bytes (per worker) in front of an optional SQLite
+    file (shared by every worker on the box). Entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, path=None, max_bytes=32 * 1024 * 1024, ttl=24 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory = OrderedDict()  # key -> (created_at, text, size in bytes)
+        self.bytes = 0
+        self.writes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        self.db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")  # several workers write at once
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created_at REAL NOT NULL, text TEXT NOT NULL)"
+            )
+            self.db.commit()
+        self.lock = threading.Lock()  # get/put run in worker threads, one at a time
+
+    def get(self, key):
+        with self.lock:
+            now = time.time()
+            entry = self.memory.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                self._forget(key)
+
+            if self.db:
+                row = self.db.execute(
+                    "SELECT created_at, text FROM responses WHERE key = ? AND created_at > ?", (key, now - self.ttl)
+                ).fetchone()
+                if row:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._remember(key, row[0], row[1])
+                    return row[1]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, text):
+        with self.lock:
+            now = time.time()
+            self._remember(key, now, text)
+            if self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO responses (key, created_at, text) VALUES (?, ?, ?)", (key, now, text)
+                )
+                self.writes += 1
+                if self.writes % 100 == 0:
+                    self.db.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+                self.db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "entries_in_memory": len(self.memory),
+            "bytes_in_memory": self.bytes,
+        }
+
+    def _remember(self, key, created_at, text):
+        size = len(text.encode())
+        if size > self.max_bytes:
+            return
+        self._forget(key)
+        self.memory[key] = (created_at, text, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            old_key = next(iter(self.memory))
+            self._forget(old_key)
+            self.evictions += 1
+
+    def _forget(self, key):
+        entry = self.memory.pop(key, None)
+        if entry:
+            self.bytes -= entry[2]
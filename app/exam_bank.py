@@ -0,0 +1,98 @@
+"""
+Strict schema and incremental parser for the streamed test bank.
+"""
+import json
+
+DIFFICULTIES = ("easy", "medium", "hard")
+
+QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "difficulty": {"type": "string", "enum": list(DIFFICULTIES)},
+        "question": {"type": "string"},
+        "std_answer": {"type": "string"},
+    },
+    "required": ["difficulty", "question", "std_answer"],
+    "additionalProperties": False,
+}
+
+TEST_BANK_SCHEMA = {
+    "name": "test_bank",
+    "schema": {
+        "type": "object",
+        "properties": {"questions": {"type": "array", "items": QUESTION_SCHEMA}},
+        "required": ["questions"],
+        "additionalProperties": False,
+    },
+}
+
+
+def parse_question(text):
+    """
+    One question object (JSON text) -> a clean dict, or None if it doesn't hold up.
+    """
+    try:
+        item = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(item, dict):
+        return None
+    question = item.get("question")
+    std_answer = item.get("std_answer")
+    if not isinstance(question, str) or not isinstance(std_answer, str):
+        return None
+    if not question.strip() or not std_answer.strip():
+        return None
+    difficulty = str(item.get("difficulty", "")).lower()
+    return {
+        "difficulty": difficulty if difficulty in DIFFICULTIES else "medium",
+        "question": question.strip(),
+        "std_answer": std_answer.strip(),
+    }
+
+
+class QuestionStream:
+    """
+    Reads the streamed text of {"questions": [{...}, ...]} and hands back each
+    question object's JSON as soon as its closing brace arrives, without waiting
+    for (or needing) the rest of the document.
+    """
+
+    ITEM_DEPTH = 3  # root object > questions array > question object
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.item_start = None
+
+    def feed(self, delta):
+        """
+        Returns the JSON text of every question object completed by this delta.
+        """
+        self.text += delta
+        items = []
+        for pos in range(self.pos, len(self.text)):
+            ch = self.text[pos]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+                if ch == "{" and self.depth == self.ITEM_DEPTH:
+                    self.item_start = pos
+            elif ch in "}]":
+                if ch == "}" and self.depth == self.ITEM_DEPTH and self.item_start is not None:
+                    items.append(self.text[self.item_start:pos + 1])
+                    self.item_start = None
+                self.depth -= 1
+        self.pos = len(self.text)
+        return items
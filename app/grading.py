@@ -0,0 +1,86 @@
+"""
+Local pre-grader for exam answers. Clear-cut answers ("I don't know", or a near-verbatim
+restatement of the standard answer) get a verdict here, and only the ambiguous ones go
+to the LLM grader.
+"""
+import difflib
+import re
+
+from app.retrieval import tokenize
+
+DONT_KNOW = re.compile(
+    r"\b(i (really |honestly )?(don'?t|do not|dunno) (know|remember)|no idea|no clue"
+    r"|my notes (don'?t|do not|didn'?t) (say|mention|cover)|(isn'?t|not|nothing) in my notes"
+    r"|can'?t remember|don'?t recall)\b",
+    re.IGNORECASE,
+)
+# SequenceMatcher ratio against the standard answer for a local PASS
+RESTATEMENT_RATIO = 0.9
+NEGATION = re.compile(r"\b(not|no|never|isn'?t|aren'?t|doesn'?t|don'?t|wasn'?t|can'?t|won'?t)\b", re.IGNORECASE)
+
+
+def pregrade(answer, std_answer):
+    """
+    Returns (passed, confidence). passed is None when the answer needs a real grader.
+    """
+    answer = (answer or "").strip()
+    if not answer:
+        return False, 1.0
+
+    words = answer.split()
+    key_terms = set(tokenize(std_answer))
+    answer_terms = set(tokenize(answer))
+    if DONT_KNOW.search(answer) and not key_terms & answer_terms:
+        # Nothing but the admission is a FAIL by the grading rules; one that goes on
+        # to give an answer is graded on that answer
+        return False, 0.98 if len(words) <= 12 else 0.6
+
+    if not key_terms:
+        return None, 0.0
+
+    recall = len(key_terms & answer_terms) / len(key_terms)
+    similarity = difflib.SequenceMatcher(None, answer.lower(), std_answer.lower()).ratio()
+
+    # Only a near-verbatim restatement passes locally. Having all the key terms is
+    # not enough: "the cell makes ATP for the mitochondria" has every one of them
+    if similarity >= RESTATEMENT_RATIO and recall == 1.0:
+        confidence = similarity
+        if NEGATION.search(answer) and not NEGATION.search(std_answer):
+            # "It's NOT X" is a close match too
+            confidence -= 0.3
+        return True, round(confidence, 2)
+
+    if recall == 0 and similarity < 0.3:
+        # Nothing in common, but it could still be a paraphrase
+        return False, 0.8
+
+    return None, 0.0
+
+
+class PregradeStats:
+    """
+    How often local verdicts match the LLM's, per confidence band, for tuning
+    PREGRADE_CONFIDENCE. Only answers the LLM also graded are compared.
+    """
+
+    def __init__(self):
+        self.local = 0  # verdicts taken without an LLM call
+        self.sent = 0  # answers that went to the LLM
+        self.bands = {}  # "0.9" -> [agreed, compared]
+
+    def record(self, confidence, agreed):
+        band = self.bands.setdefault(f"{int(confidence * 10) / 10:.1f}", [0, 0])
+        band[0] += agreed
+        band[1] += 1
+
+    def stats(self):
+        agreed = sum(a for a, _ in self.bands.values())
+        compared = sum(n for _, n in self.bands.values())
+        return {
+            "local": self.local,
+            "sent_to_llm": self.sent,
+            "agreement": agreed / compared if compared else None,
+            "agreement_by_confidence": {
+                band: {"agreed": a, "compared": n} for band, (a, n) in sorted(self.bands.items())
+            },
+        }
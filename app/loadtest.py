@@ -0,0 +1,159 @@
+"""
+Drives N simulated teachers through /ws end to end and reports latencies.
+
+Start the server against the mock backend first, e.g.
+
+    LLM_BACKEND=mock uvicorn app.main:app --workers 2
+
+then
+
+    python -m app.loadtest --sessions 200 --concurrency 50 --workers 2
+"""
+import argparse
+import asyncio
+import random
+import re
+import time
+
+import websockets
+
+ANSI = re.compile(r"\x1b\[[0-9;]*m")
+TOPICS = ["photosynthesis", "black holes", "the french revolution", "binary search", "volcanoes"]
+LINES = [
+    "Plants turn sunlight into sugar.",
+    "That process happens in the leaves?",
+    "The sugar gives the plant energy to grow.",
+    "Chlorophyll is what makes leaves green.",
+    "Does that make sense so far?",
+    "Oxygen comes out as a by-product.",
+]
+# After a NAP event the student snores through every turn (no LLM call) until woken
+WAKE_UP = "Hey, wake up!"
+SNORE = "(snore)"
+
+
+class GameOver(Exception):
+    pass
+
+
+class Teacher:
+    def __init__(self, ws):
+        self.ws = ws
+        self.buffer = ""
+        self.last_output = ""  # what came before the marker wait_for last returned on
+
+    async def wait_for(self, *markers, first_byte_after=None):
+        """
+        Reads until one of the markers shows up. Returns (marker, seconds to the first
+        output after `first_byte_after`, or None).
+        """
+        started = time.monotonic()
+        first_byte = None
+        while True:
+            for marker in markers:
+                idx = self.buffer.find(marker)
+                if idx >= 0:
+                    self.last_output = self.buffer[:idx]
+                    self.buffer = self.buffer[idx + len(marker):]
+                    return marker, first_byte
+            if "GAME OVER" in self.buffer:
+                raise GameOver()
+
+            self.buffer += ANSI.sub("", await self.ws.recv())
+            if first_byte is None and first_byte_after and first_byte_after in self.buffer:
+                tail = self.buffer.split(first_byte_after, 1)[1]
+                if tail.strip():
+                    first_byte = time.monotonic() - started
+
+    async def send(self, text):
+        await self.ws.send(text)
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run_session(url, turns, results):
+    async with websockets.connect(url, max_size=None) as ws:
+        teacher = Teacher(ws)
+        try:
+            await teacher.wait_for("Select (1-6): ")
+            await teacher.send(str(random.randint(1, 5)))
+            await teacher.wait_for("Enter the topic you want to teach: ")
+            await teacher.send(random.choice(TOPICS))
+            await teacher.wait_for("You: ")
+
+            asleep = False
+            for _ in range(turns):
+                while asleep:
+                    await teacher.send(WAKE_UP)
+                    await teacher.wait_for("You: ")
+                    asleep = SNORE in teacher.last_output
+
+                started = time.monotonic()
+                await teacher.send(random.choice(LINES))
+                _, ttft = await teacher.wait_for("You: ", first_byte_after="[STUDENT]: ")
+                if SNORE in teacher.last_output:
+                    # Instant and LLM-free, it would only drag the percentiles down
+                    asleep = True
+                    results["asleep"] += 1
+                    continue
+                results["turn"].append(time.monotonic() - started)
+                if ttft is not None:
+                    results["ttft"].append(ttft)
+
+            started = time.monotonic()
+            await teacher.send("TEST")
+            verdict, _ = await teacher.wait_for("PASSED!", "FAILED.")
+            results["exam"].append(time.monotonic() - started)
+
+            if verdict == "FAILED.":
+                await teacher.send("QUIT")
+        except GameOver:
+            pass
+    results["sessions"] += 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://localhost:8000/ws")
+    parser.add_argument("--sessions", type=int, default=20, help="total simulated teachers")
+    parser.add_argument("--concurrency", type=int, default=10, help="teachers connected at once")
+    parser.add_argument("--turns", type=int, default=5, help="teaching turns before the exam")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers behind --url (for per-worker rates)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    results = {"turn": [], "ttft": [], "exam": [], "sessions": 0, "errors": 0, "asleep": 0}
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        async with gate:
+            try:
+                await run_session(args.url, args.turns, results)
+            except Exception as e:
+                results["errors"] += 1
+                print(f"session failed: {type(e).__name__}: {e}")
+
+    started = time.monotonic()
+    await asyncio.gather(*(one() for _ in range(args.sessions)))
+    elapsed = time.monotonic() - started
+
+    print(f"\n{results['sessions']} sessions in {elapsed:.1f}s ({results['errors']} errors)")
+    rate = results["sessions"] / elapsed
+    print(f"sessions/s: {rate:.2f} total, {rate / args.workers:.2f} per worker")
+    print(f"turns left out (student asleep): {results['asleep']}")
+    for name in ("ttft", "turn", "exam"):
+        values = results[name]
+        print(
+            f"{name:>5} latency (n={len(values)}): "
+            f"p50={percentile(values, 50):.2f}s p95={percentile(values, 95):.2f}s p99={percentile(values, 99):.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,11 +2,34 @@ import asyncio
 import json
 import random
 import os
+import time
+import uuid
 from fastapi import FastAPI, WebSocket, Request, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from openai import AsyncOpenAI
 
+from app.budget import IpBudgets, active_steps, ip_label, parse_steps
+from app.cache import LessonCache, ResponseCache, response_key
+from app.exam_bank import TEST_BANK_SCHEMA, QuestionStream, parse_question
+from app.grading import PregradeStats, pregrade
+from app.metrics import (
+    ACTIVE_SESSIONS, BUDGET_STEPS_TAKEN, CHAT_HISTORY_SAVED_CHARS, CHAT_PROMPT_CHARS, LLM_CALL_SECONDS, LLM_CALLS,
+    LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_SECONDS, LLM_TOKENS,
+    NOTES_COMPACTED, OPEN_SESSIONS_MEMORY_BYTES, PHASE_SECONDS, PREGRADES, SESSION_MEMORY_BYTES, SESSION_SNAPSHOT_BYTES,
+    SESSIONS_IDLED, SESSIONS_REJECTED,
+    WS_PENDING_SENDS, WS_SEND_QUEUE, WS_SEND_SECONDS, registry, timed,
+)
+from app.prompts import (
+    PromptCacheStats, chat_turn_state, exam_messages, grade_batch_messages, grade_messages, note_messages,
+    student_system_prompt,
+)
+from app.resilience import CircuitBreaker, LatencyTracker, call_with_retries, is_retryable
+from app.retrieval import NoteIndex
+from app.scheduler import BACKGROUND, EXAM, INTERACTIVE, PRIORITY_NAMES, LLMScheduler, estimate_tokens
+from app.session_store import dump_snapshot, load_snapshot, make_session_store, new_resume_token
+from app.tracing import span, start_tracing, traced
+
 # --- CONFIGURATION ---
 # We use standard ANSI codes for the web terminal
 RESET = "\033[0m"
@@ -17,47 +40,367 @@ CYAN = "\033[36m"
 MAGENTA = "\033[35m"
 WHITE = "\033[37m"
 
+# Exam settings
+TEST_BANK_SIZE = 10  # questions generated per lesson
+EXAM_SIZE = 5  # questions per exam; the exam can start as soon as this many are ready
+TEST_BANK_REGENERATE_ROUNDS = 3  # calls to fill in questions that came back malformed or repeated
+# "concurrent" answers and grades every question in parallel, "sequential" streams them one by one
+QUIZ_MODE = os.getenv("QUIZ_MODE", "concurrent")
+QUIZ_CONCURRENCY = int(os.getenv("QUIZ_CONCURRENCY", "5"))  # max in-flight exam questions per session
+# "batch" grades the whole exam in one JSON call, "each" sends one grading call per question
+GRADING_MODE = os.getenv("GRADING_MODE", "batch")
+# Local pre-grading (app/grading.py): "on" takes local verdicts at or above PREGRADE_CONFIDENCE
+# without an LLM call, "shadow" still sends everything to the LLM and only records agreement, "off"
+PREGRADE = os.getenv("PREGRADE", "on")
+PREGRADE_CONFIDENCE = float(os.getenv("PREGRADE_CONFIDENCE", "0.9"))
+
+# Curriculum + test bank cache per topic (set LESSON_CACHE_PATH="" for memory only)
+LESSON_CACHE_PATH = os.getenv("LESSON_CACHE_PATH", ".cache/lessons.db")
+LESSON_CACHE_TTL = int(os.getenv("LESSON_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+LESSON_CACHE_MAX_TOPICS = int(os.getenv("LESSON_CACHE_MAX_TOPICS", "256"))
+LESSON_CACHE_VARIANTS = int(os.getenv("LESSON_CACHE_VARIANTS", "3"))  # different exams kept per topic
+
+# Student conversation budget. Older turns get folded into a summary (~4 chars per token)
+HISTORY_CHAR_BUDGET = int(os.getenv("HISTORY_CHAR_BUDGET", "6000"))
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))  # teacher/student pairs always kept verbatim
+
+# Which notes go into the note-taking, reply and exam prompts: "retrieval" sends the
+# NOTEBOOK_TOP_K most relevant to the teacher's input / exam question (local BM25, see
+# app/retrieval.py), so prompts stay flat as the notebook grows. "all" sends every note
+NOTEBOOK_CONTEXT = os.getenv("NOTEBOOK_CONTEXT", "retrieval")
+NOTEBOOK_TOP_K = int(os.getenv("NOTEBOOK_TOP_K", "12"))
+
+# Content-addressed cache of LLM responses (opt-in), keyed on model + input + format.
+# Only the call sites in LLM_CACHE_SITES are cached, and never the student chat or any
+# streamed / server-side-state call. LLM_CACHE_PATH adds an SQLite tier shared by every worker
+LLM_CACHE = os.getenv("LLM_CACHE", "0") == "1"
+LLM_CACHE_SITES = set(os.getenv("LLM_CACHE_SITES", "curriculum,misconception,grade,grade_batch").split(",")) - {"chat"}
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))  # seconds
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+
+# Notebook compaction. Each new note replaces an older near-duplicate of itself (term overlap
+# >= NOTE_DEDUP_SIMILARITY), and every NOTE_CONSOLIDATE_EVERY notes a background call rewrites
+# the notebook into canonical notes (corrections applied, repeats merged; 0 = never).
+# The exam's brain dump still shows every note as written
+NOTE_DEDUP_SIMILARITY = float(os.getenv("NOTE_DEDUP_SIMILARITY", "0.8"))
+NOTE_CONSOLIDATE_EVERY = int(os.getenv("NOTE_CONSOLIDATE_EVERY", "8"))
+
+# "pipelined" writes the note and the student's reply at the same time, "sequential" writes the note first
+TURN_MODE = os.getenv("TURN_MODE", "pipelined")
+
+# Where the student conversation lives:
+# "local" resends conversation_history every turn, "conversation" uses an OpenAI conversation id,
+# "previous_response" chains turns with previous_response_id. The last two only upload the new turn.
+CONVERSATION_STATE = os.getenv("CONVERSATION_STATE", "local")
+
+# "openai" or "mock" (offline stand-in for benchmarks, see app/mock_llm.py)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+
+# Process-wide LLM admission control, shared by every session (0 = unlimited)
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "32"))
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))  # requests per minute
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))  # tokens per minute
+# Seconds of queueing that move a waiting call up one priority class (0 = strict priority)
+LLM_PRIORITY_AGING = float(os.getenv("LLM_PRIORITY_AGING", "10"))
+
+# Scheduling class of every _call_llm call site
+CALL_SITE_PRIORITY = {
+    "chat": INTERACTIVE,
+    "note": INTERACTIVE,
+    "exam_answer": EXAM,
+    "grade": EXAM,
+    "grade_batch": EXAM,
+    "curriculum": BACKGROUND,
+    "test_bank": BACKGROUND,
+    "misconception": BACKGROUND,
+    "eureka": BACKGROUND,
+    "summary": BACKGROUND,
+    "consolidate": BACKGROUND,
+}
+
+# Model routing per call site: model, output token cap and reasoning effort (None = model default).
+# The student's voice stays on the strong model; one-word grades and short notes go to the fast tier.
+# Per-deployment overrides: LLM_ROUTES='{"grade": {"model": "gpt-5-nano"}, "chat": {"reasoning_effort": "low"}}'
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-5.2")
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gpt-5-mini")
+CALL_SITE_MODEL = {
+    "chat": {"model": LLM_MODEL, "max_output_tokens": 2048, "reasoning_effort": None},
+    "exam_answer": {"model": LLM_MODEL, "max_output_tokens": 1024, "reasoning_effort": None},
+    "curriculum": {"model": LLM_MODEL, "max_output_tokens": 2048, "reasoning_effort": None},
+    "test_bank": {"model": LLM_MODEL, "max_output_tokens": 4096, "reasoning_effort": None},
+    "note": {"model": LLM_FAST_MODEL, "max_output_tokens": 256, "reasoning_effort": "minimal"},
+    "grade": {"model": LLM_FAST_MODEL, "max_output_tokens": 64, "reasoning_effort": "minimal"},
+    "grade_batch": {"model": LLM_FAST_MODEL, "max_output_tokens": 1024, "reasoning_effort": "low"},
+    "misconception": {"model": LLM_FAST_MODEL, "max_output_tokens": 256, "reasoning_effort": "minimal"},
+    "eureka": {"model": LLM_FAST_MODEL, "max_output_tokens": 128, "reasoning_effort": "minimal"},
+    "summary": {"model": LLM_FAST_MODEL, "max_output_tokens": 512, "reasoning_effort": "minimal"},
+    "consolidate": {"model": LLM_FAST_MODEL, "max_output_tokens": 2048, "reasoning_effort": "low"},
+}
+for _site, _override in json.loads(os.getenv("LLM_ROUTES", "{}")).items():
+    CALL_SITE_MODEL.setdefault(_site, dict(CALL_SITE_MODEL["chat"])).update(_override)
+
+# Resilience: per-attempt timeouts (seconds, not counting time queued in the scheduler),
+# retries with exponential backoff, optional hedging past a site's p95 latency,
+# and a circuit breaker that serves canned replies while the provider is down
+CALL_SITE_TIMEOUT = {
+    "chat": 45,
+    "note": 20,
+    "exam_answer": 30,
+    "grade": 20,
+    "grade_batch": 45,
+    "curriculum": 45,
+    "test_bank": 90,
+    "misconception": 20,
+    "eureka": 20,
+    "summary": 30,
+    "consolidate": 45,
+}
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "0.5"))  # seconds, doubled every retry
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+# Session snapshots, so a dropped connection can resume (on any worker with "sqlite")
+SESSION_STORE = os.getenv("SESSION_STORE", "sqlite")  # "sqlite" or "memory"
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", ".cache/sessions.db")
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(24 * 3600)))  # seconds a dropped session can be resumed
+
+# Admission control: idle sessions get snapshotted and closed, and new ones are
+# turned away once the worker is full (0 turns either off)
+IDLE_TIMEOUT = float(os.getenv("IDLE_TIMEOUT", "900"))  # seconds without real input (pings don't count)
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "200"))  # per worker
+
+# Token budgets (input + output, from response.usage) per session and per client IP per
+# IP_BUDGET_WINDOW seconds; 0 = unlimited. The IP budget is off by default: behind a proxy
+# every player shares the proxy's address unless FORWARDED_ALLOW_IPS trusts it.
+# Past each BUDGET_STEPS threshold (fraction of the tighter budget) the session degrades:
+# short_history folds history much earlier, small_model moves every call to
+# LLM_FAST_MODEL, stop ends the game
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "400000"))
+IP_TOKEN_BUDGET = int(os.getenv("IP_TOKEN_BUDGET", "0"))
+IP_BUDGET_WINDOW = int(os.getenv("IP_BUDGET_WINDOW", "3600"))
+BUDGET_STEPS = parse_steps(os.getenv("BUDGET_STEPS", "0.6:short_history,0.8:small_model,1:stop"))
+
+# Per-session Chrome trace files. Off unless TRACE_DIR is set; then sessions opened
+# with /?trace=1 are traced, plus a random TRACE_SAMPLE_RATE share of the rest
+TRACE_DIR = os.getenv("TRACE_DIR", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+# What the player gets when the provider is unhealthy (JSON calls get "{}", others "")
+CANNED_REPLIES = {
+    "chat": "Sorry, I totally zoned out. Can you say that again?",
+    "note": "NOTHING",
+    "exam_answer": "I don't know.",
+    "grade": "FAIL",
+}
+
 app = FastAPI()
 templates = Jinja2Templates(directory="app/templates")
-client = AsyncOpenAI()
+if LLM_BACKEND == "mock":
+    from app.mock_llm import MockAsyncOpenAI
+    client = MockAsyncOpenAI(
+        latency=float(os.getenv("MOCK_LATENCY", "0.8")),
+        jitter=float(os.getenv("MOCK_JITTER", "0.4")),
+        tokens_per_sec=float(os.getenv("MOCK_TOKENS_PER_SEC", "60")),
+        failure_rate=float(os.getenv("MOCK_FAILURE_RATE", "0")),
+        seed=int(os.getenv("MOCK_SEED", "0")),
+    )
+else:
+    client = AsyncOpenAI(max_retries=0)  # retries are handled by call_with_retries
+lesson_cache = LessonCache(
+    LESSON_CACHE_PATH,
+    max_topics=LESSON_CACHE_MAX_TOPICS,
+    ttl=LESSON_CACHE_TTL,
+    variants=LESSON_CACHE_VARIANTS,
+)
+response_cache = ResponseCache(LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL)
+scheduler = LLMScheduler(LLM_MAX_IN_FLIGHT, rpm=LLM_RPM, tpm=LLM_TPM, aging=LLM_PRIORITY_AGING)
+breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN)
+session_store = make_session_store(SESSION_STORE, SESSION_STORE_PATH, SESSION_TTL)
+latency = LatencyTracker()
+pregrade_stats = PregradeStats()
+prompt_cache_stats = PromptCacheStats()
+ip_budgets = IpBudgets(IP_TOKEN_BUDGET, IP_BUDGET_WINDOW)
+open_sessions = set()  # AsyncTeachingSimulator instances connected to this worker
+
+class SessionIdle(Exception):
+    """Raised from get_input when the teacher hasn't typed anything for IDLE_TIMEOUT seconds."""
 
 @app.get("/", response_class=HTMLResponse)
 async def get(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+@app.get("/stats")
+async def stats():
+    return {
+        "sessions": {
+            "open": len(open_sessions),
+            "max": MAX_SESSIONS,
+            "memory_bytes": sum(game.memory_bytes for game in open_sessions),
+            "largest_memory_bytes": max((game.memory_bytes for game in open_sessions), default=0),
+        },
+        "lesson_cache": lesson_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "scheduler": scheduler.stats(),
+        "breaker": breaker.stats(),
+        "pregrade": pregrade_stats.stats(),
+        "prompt_cache": prompt_cache_stats.stats(),
+        "budgets": {
+            "session_limit": SESSION_TOKEN_BUDGET,
+            "ip_limit": IP_TOKEN_BUDGET,
+            "ip_window_seconds": IP_BUDGET_WINDOW,
+            # Biggest spenders first
+            "sessions": [
+                game.budget_stats()
+                for game in sorted(open_sessions, key=lambda g: sum(g.tokens_used.values()), reverse=True)[:20]
+            ],
+            "ips": ip_budgets.stats(),
+        },
+        "routes": CALL_SITE_MODEL,
+        "latency_p95": {site: latency.percentile(site, 95) for site in CALL_SITE_PRIORITY},
+    }
+
+@app.get("/metrics")
+async def metrics():
+    LLM_IN_FLIGHT.set(scheduler.in_flight)
+    for priority, depth in scheduler.queue_depth().items():
+        LLM_QUEUE_DEPTH.set(depth, priority=priority)
+    OPEN_SESSIONS_MEMORY_BYTES.set(sum(game.memory_bytes for game in open_sessions))
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    game = AsyncTeachingSimulator(websocket)
+    if MAX_SESSIONS and len(open_sessions) >= MAX_SESSIONS:
+        await websocket.send_text(f"{RED}Server busy, too many classes in session. Try again in a minute.{RESET}\r\n")
+        await websocket.close(code=1013)  # Try Again Later
+        SESSIONS_REJECTED.inc()
+        return
+
+    client_ip = client_address(websocket)
+    if "stop" in active_steps(ip_budgets.fraction(client_ip), BUDGET_STEPS):
+        await websocket.send_text(f"{RED}Your network has used up its token budget for now. Try again later.{RESET}\r\n")
+        await websocket.close(code=1013)
+        SESSIONS_REJECTED.inc()
+        return
+
+    tracer = None
+    if TRACE_DIR and (websocket.query_params.get("trace") == "1" or random.random() < TRACE_SAMPLE_RATE):
+        tracer = start_tracing(uuid.uuid4().hex[:8], TRACE_DIR)
+
+    game = AsyncTeachingSimulator(websocket, client_ip)
+    open_sessions.add(game)
+    ACTIVE_SESSIONS.inc()
     try:
-        await game.start()
+        await game.run(resume_token=websocket.query_params.get("resume"))
     except WebSocketDisconnect:
         print("Client disconnected")
+    except SessionIdle:
+        SESSIONS_IDLED.inc()
+        if game.session_token:
+            await websocket.send_text(f"\r\n{RED}Idle for too long. Your lesson is saved, refresh to resume.{RESET}\r\n")
+        else:
+            await websocket.send_text(f"\r\n{RED}Idle for too long. Refresh to start again.{RESET}\r\n")
+        await websocket.close()
     except Exception as e:
         await websocket.send_text(f"{RED}Error: {e}{RESET}\r\n")
         await websocket.close()
+    finally:
+        open_sessions.discard(game)
+        ACTIVE_SESSIONS.dec()
+        # Keep the game around so the client can pick it up again
+        await game.save_session()
+        if tracer:
+            print(f"Trace written to {tracer.write()}")
+
+def client_address(websocket):
+    # uvicorn --proxy-headers already swapped in the X-Forwarded-For address, but only
+    # for hops listed in FORWARDED_ALLOW_IPS; the header itself is the client's to forge
+    return websocket.client.host if websocket.client else "unknown"
+
+def record_usage(site, usage):
+    if not usage:
+        return
+    LLM_TOKENS.inc(usage.input_tokens, site=site, kind="input")
+    LLM_TOKENS.inc(usage.output_tokens, site=site, kind="output")
+    prompt_cache_stats.record(site, usage)
+    details = getattr(usage, "input_tokens_details", None)
+    if details and details.cached_tokens:
+        LLM_TOKENS.inc(details.cached_tokens, site=site, kind="cached")
+
+class MeteredWebSocket:
+    """
+    Wraps the game's WebSocket to measure sends. Background tasks and streams can
+    send at the same time, so sends may queue up behind each other.
+    """
+    def __init__(self, ws):
+        self._ws = ws
+        self.pending = 0
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+    async def send_text(self, text):
+        WS_SEND_QUEUE.observe(self.pending)
+        self.pending += 1
+        WS_PENDING_SENDS.inc()
+        started = time.monotonic()
+        try:
+            with span("ws.send_text", chars=len(text)):
+                await self._ws.send_text(text)
+        finally:
+            self.pending -= 1
+            WS_PENDING_SENDS.dec()
+            WS_SEND_SECONDS.observe(time.monotonic() - started)
 
 # --- THE GAME LOGIC (Exact Port) ---
 
 class AsyncTeachingSimulator:
-    def __init__(self, ws: WebSocket):
-        self.ws = ws
+    def __init__(self, ws: WebSocket, client_ip="unknown"):
+        self.ws = MeteredWebSocket(ws)
+        self.client_ip = client_ip
+        self.stats_id = uuid.uuid4().hex[:8]  # names this session in /stats
+        self.tokens_used = {"input": 0, "output": 0}  # this session's spend, against SESSION_TOKEN_BUDGET
+        self.budget_announced = []  # degradation steps the player has been told about
         self.topic = ""
         self.curriculum = [] 
         self.test_questions = [] 
+        self.setup_task = None  # background curriculum + test bank generation
+        self.questions_ready = asyncio.Event()  # set once there are EXAM_SIZE questions (or setup gave up)
+        self.session_token = None  # resume token, handed to the client once the game is set up
+        self.finished = False
+        self.memory_bytes = 0  # rough size of the game state, updated every turn
+        self.save_lock = asyncio.Lock()  # keeps snapshot writes in order
+        self.inbox = asyncio.Queue()  # teacher input, filled by read_socket
+        self.reply_task = None  # the student's streamed reply, while it's streaming (for __INTERRUPT__)
         
         # Student Internal State
-        self.knowledge_ledger = []
+        self.knowledge_ledger = []  # working notebook, compacted as it grows
+        self.raw_notes = []  # every note as written, for the exam's brain dump
+        self.notes_since_consolidation = 0
+        self.note_index = NoteIndex()  # rebuilt from the ledger on demand, not snapshotted
         self.attention_span = 80 
         self.attempts_left = 3
         self.persona = ""
         
         # CONVERSATION STATE
         self.conversation_history = []
+        self.history_summary = ""  # rolling summary of turns folded out of conversation_history
+        self.folded_chars = 0  # chars of those turns, to measure what the summary saves
+        self.summary_task = None
+        self.student_conversation_id = None  # CONVERSATION_STATE="conversation"
+        self.student_response_id = None  # CONVERSATION_STATE="previous_response"
         
         # EVENT FLAGS
         self.is_asleep = False
         self.alien_countdown = -1  # -1 means no alien event
+        self.background_tasks = set()  # event effects and notebook compaction still waiting on the LLM
+        self.event_effects = set()  # the MISCONCEPTION / EUREKA ones, which the exam waits for
+
+        # Caps how many exam questions this session answers/grades at once
+        self.quiz_semaphore = asyncio.Semaphore(QUIZ_CONCURRENCY)
 
     # --- I/O HELPERS (Async conversion) ---
     async def print_system(self, text):
@@ -74,6 +417,20 @@ class AsyncTeachingSimulator:
         if prompt_text:
             await self.ws.send_text(f"{GREEN}{prompt_text}{RESET}")
         
+        try:
+            data = await asyncio.wait_for(self.inbox.get(), IDLE_TIMEOUT or None)
+        except TimeoutError:
+            raise SessionIdle()
+
+        # Echo the input back to the terminal so the user sees what they typed
+        # await self.ws.send_text(f"{data}\r\n")
+        return data.strip()
+
+    async def read_socket(self):
+        """
+        Reads the socket for the whole session so a disconnect or an interrupt is
+        noticed right away, not at the next prompt.
+        """
         while True:
             data = await self.ws.receive_text()
 
@@ -81,35 +438,124 @@ class AsyncTeachingSimulator:
                 # Ignore heartbeat messages
                 continue
 
-            # Echo the input back to the terminal so the user sees what they typed
-            # await self.ws.send_text(f"{data}\r\n")
-            return data.strip()
+            if data == "__INTERRUPT__":
+                # Ctrl+C in the terminal: cut the student off mid-reply
+                if self.reply_task and not self.reply_task.done():
+                    self.reply_task.cancel()
+                continue
 
-    async def _call_llm(self, messages, json_mode=False):
+            await self.inbox.put(data)
+
+    async def _call_llm(self, messages, json_mode=False, stream=False, site="default",
+                        conversation_id=None, previous_response_id=None, meta=None,
+                        json_schema=None, on_delta=None):
         """
         Standardized wrapper for OpenAI Chat Completions.
+        If stream=True, text deltas are written to the terminal as they arrive,
+        or handed to on_delta(delta) instead if that is given.
+        JSON mode calls only stream to an on_delta (half a JSON blob is useless to the player).
+        json_schema ({"name": ..., "schema": ...}) asks for strict structured output; implies json_mode.
+        site names the call site; it picks the scheduling priority (see CALL_SITE_PRIORITY).
+        conversation_id / previous_response_id continue server-side state.
+        If a meta dict is passed, the response id and usage are written to it.
         """
         response_api = True
 
         if response_api:
             response_format = {"type": "text"}
-            if json_mode:
+            if json_schema:
+                json_mode = True
+                response_format = {"type": "json_schema", "strict": True, **json_schema}
+            elif json_mode:
                 response_format = {"type": "json_object"}
             
             if messages[0]['role'] == 'system':
                 # for some reason openai uses 'developer' in responses API
                 messages[0]['role'] = 'developer'
             
+            route = CALL_SITE_MODEL.get(site, CALL_SITE_MODEL["chat"])
+            steps = self.budget_steps()
+            if "small_model" in steps:
+                route = {**route, "model": LLM_FAST_MODEL}
             kwargs = {
-                "model": "gpt-5.2",
+                "model": route["model"],
                 "input": messages,
                 "text": {"format": response_format},
-                "max_output_tokens": 2048,
+                "max_output_tokens": route["max_output_tokens"],
+                # Keeps one call site's requests on the same cache shard (see app/prompts.py)
+                "prompt_cache_key": site,
             }
 
-            response = await client.responses.create(**kwargs)
+            if route.get("reasoning_effort"):
+                kwargs["reasoning"] = {"effort": route["reasoning_effort"]}
+
+            # Only pass server-side state if it exists
+            if conversation_id:
+                kwargs["conversation"] = conversation_id
+            if previous_response_id:
+                kwargs["previous_response_id"] = previous_response_id
+
+            if meta is None:
+                meta = {}
+            stream = stream and (on_delta is not None or not json_mode)
+            to_terminal = stream and on_delta is None
 
-            return response.output_text
+            cache_key = None
+            if LLM_CACHE and site in LLM_CACHE_SITES and not (stream or conversation_id or previous_response_id):
+                cache_key = response_key(kwargs)
+                # SQLite lookups (and commits on put) run off the event loop, like snapshot saves
+                cached = await asyncio.to_thread(response_cache.get, cache_key)
+                if cached is not None:
+                    LLM_CALLS.inc(site=site, outcome="cache_hit")
+                    return cached
+
+            if "stop" in steps:
+                LLM_CALLS.inc(site=site, outcome="over_budget")
+                return await self._degraded_reply(site, json_mode, to_terminal)
+
+            if not breaker.allow():
+                LLM_CALLS.inc(site=site, outcome="breaker_open")
+                return await self._degraded_reply(site, json_mode, to_terminal)
+
+            hedge_after = None
+            if LLM_HEDGE and not stream and not any(scheduler.queue_depth().values()):
+                # Duplicating requests while others are queued would only make things worse.
+                # Streams (the student chat included) are never hedged: their deltas are
+                # already on the player's screen, two racing streams would interleave there
+                hedge_after = latency.percentile(site, 95)
+
+            try:
+                with span(f"llm:{site}", stream=stream):
+                    text = await call_with_retries(
+                        lambda: self._request(kwargs, site, stream, meta, on_delta),
+                        retries=LLM_RETRIES,
+                        backoff=LLM_BACKOFF,
+                        hedge_after=hedge_after,
+                        # Never retry a stream the player has already seen part of
+                        should_retry=lambda e: is_retryable(e) and not meta.get("chunks"),
+                    )
+            except asyncio.CancelledError:
+                breaker.abandon_probe()
+                raise
+            except Exception as e:
+                print(f"API Error ({site}): {e}")
+                LLM_CALLS.inc(site=site, outcome="error")
+                if is_retryable(e):
+                    breaker.record_failure()
+                else:
+                    # 400, context length, content filter, auth: it's this request that's wrong,
+                    # not the provider, so the breaker learns nothing (a probe goes to the next call)
+                    breaker.abandon_probe()
+                if meta.get("chunks"):
+                    # Keep whatever the player already saw
+                    return "".join(meta["chunks"]).strip()
+                return await self._degraded_reply(site, json_mode, to_terminal)
+
+            breaker.record_success()
+            LLM_CALLS.inc(site=site, outcome="ok")
+            if cache_key and text:
+                await asyncio.to_thread(response_cache.put, cache_key, text)
+            return text
         
 
         try:
@@ -130,27 +576,110 @@ class AsyncTeachingSimulator:
             return "{}" if json_mode else "Error"
         
 
-    async def init_student_conversation(self):
+    async def _request(self, kwargs, site, stream, meta, on_delta=None):
         """
-        Initializes the student with a STRICT prohibition on outside knowledge.
+        One attempt: waits for a scheduler slot, then calls the provider
+        under the call site's timeout.
         """
-        system_prompt = f"""\
-You are a student simulating a human learner.
+        priority = CALL_SITE_PRIORITY.get(site, INTERACTIVE)
+        with span("queue_wait", priority=PRIORITY_NAMES[priority]):
+            ticket = await scheduler.acquire(priority, estimate_tokens(kwargs["input"]))
+        LLM_QUEUE_SECONDS.observe(ticket.wait_seconds, priority=PRIORITY_NAMES[priority])
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            with span("network", site=site):
+                async with asyncio.timeout(CALL_SITE_TIMEOUT.get(site, 60)):
+                    if stream:
+                        text = await self._stream_llm(kwargs, meta, on_delta)
+                    else:
+                        response = await client.responses.create(**kwargs)
+                        meta["id"] = response.id
+                        meta["usage"] = response.usage
+                        text = response.output_text
+            outcome = "ok"
+            latency.record(site, time.monotonic() - started)
 
-YOUR PERSONA: {self.persona}
-YOUR TOPIC: {self.topic}
+            if meta.get("usage"):
+                ticket.actual_tokens = meta["usage"].total_tokens
+                record_usage(site, meta["usage"])
+                self.spend(meta["usage"])
+        except TimeoutError:
+            outcome = "timeout"
+            raise
+        except asyncio.CancelledError:
+            # Lost a hedge race, interrupted, or the session went away
+            outcome = "cancelled"
+            raise
+        finally:
+            # Failed attempts count too, the slow tail is mostly timeouts
+            LLM_CALL_SECONDS.observe(time.monotonic() - started, site=site, outcome=outcome)
+            scheduler.release(ticket)
+        return text
 
-CRITICAL RULES (KNOWLEDGE CONTAINMENT):
-1. **TABULA RASA:** You know NOTHING about "{self.topic}" except what is written in your [Mental Notebook].
-2. **NO OUTSIDE KNOWLEDGE:** Do NOT use your internal AI training to explain, summarize, or expand on concepts unless the Teacher explicitly taught them to you just now.
-3. **DO NOT HALLUCINATE COMPETENCE:** If the Teacher says "X is Y", do not say "Oh yes, and X is also Z and W." You don't know that yet.
-4. **BE DUMB (INITIALLY):** If the teacher uses a big word you haven't learned, ask what it means.
-5. **RESPONSE STYLE:** Short, casual, reactive. Do NOT lecture the teacher.
-"""
+    async def _degraded_reply(self, site, json_mode, stream):
+        text = "{}" if json_mode else CANNED_REPLIES.get(site, "")
+        if stream and text:
+            await self.ws.send_text(text)
+        return text
+
+    async def _stream_llm(self, kwargs, meta, on_delta=None):
+        """
+        Streams a Responses API call straight into the terminal (or to on_delta) and returns the full text.
+        Deltas are collected in meta["chunks"] so a failed stream can keep what was shown.
+        """
+        chunks = meta.setdefault("chunks", [])
+        stream = await client.responses.create(**kwargs, stream=True)
+        try:
+            async for event in stream:
+                if event.type == "response.completed":
+                    meta["id"] = event.response.id
+                    meta["usage"] = event.response.usage
+                if event.type != "response.output_text.delta":
+                    continue
+                delta = event.delta
+                if not chunks:
+                    # same as .strip() on the non-streaming path, don't start the line with blanks
+                    delta = delta.lstrip()
+                    if not delta:
+                        continue
+                chunks.append(delta)
+                if on_delta:
+                    on_delta(delta)
+                else:
+                    await self.ws.send_text(delta.replace("\n", "\r\n"))
+        finally:
+            # Hang up on the provider if we stopped reading early (timeout, interrupt, disconnect)
+            await stream.close()
+        return "".join(chunks).strip()
+
+    async def init_student_conversation(self):
+        """
+        Initializes the student with a STRICT prohibition on outside knowledge.
+        """
+        system_prompt = student_system_prompt(self.persona, self.topic)
         # Initialize history
         self.conversation_history = [
             {"role": "system", "content": system_prompt}
         ]
+        self.student_response_id = None
+
+        if CONVERSATION_STATE == "conversation":
+            try:
+                conv = await client.conversations.create(
+                    items=[
+                        {
+                            "type": "message",
+                            "role": "system",
+                            "content": [{"type": "input_text", "text": system_prompt}]
+                        }
+                    ]
+                )
+                self.student_conversation_id = conv.id
+            except Exception as e:
+                # Falls back to resending the local history
+                print(f"Failed to create conversation: {e}")
+                self.student_conversation_id = None
 
     # --- SETUP FUNCTIONS ---
 
@@ -175,15 +704,41 @@ CRITICAL RULES (KNOWLEDGE CONTAINMENT):
         else: 
             self.persona = options[0]
 
-    async def set_curriculum(self):
+    async def select_topic(self):
         self.topic = await self.get_input("Enter the topic you want to teach: ")
-        await self.print_system("Generating Curriculum...")
-        
+
+    @timed(PHASE_SECONDS, phase="setup")
+    @traced("setup")
+    async def prepare_lesson(self):
+        """
+        Curriculum + test bank. Runs as a background task so the teacher can start
+        teaching right away; only run_quiz needs the result.
+        """
+        try:
+            # Both tiers are behind SQLite calls that can wait on other workers, keep them off the loop
+            lesson = await asyncio.to_thread(lesson_cache.get, self.topic)
+            if lesson:
+                self.curriculum = lesson["curriculum"]
+                self.test_questions = lesson["questions"]
+                await self.save_session()
+                return
+
+            await self.set_curriculum()
+            await self.generate_test_bank()
+            if len(self.test_questions) >= EXAM_SIZE:
+                lesson = {"curriculum": self.curriculum, "questions": self.test_questions}
+                await asyncio.to_thread(lesson_cache.put, self.topic, lesson)
+            await self.save_session()
+        finally:
+            # Let a waiting exam go ahead with whatever there is
+            self.questions_ready.set()
+
+    async def set_curriculum(self):
         messages = [
             {"role": "system", "content": "Curriculum Generator."},
             {"role": "user", "content": f"List 5 simple atomic facts about {self.topic}."}
         ]
-        raw = await self._call_llm(messages)
+        raw = await self._call_llm(messages, site="curriculum")
         self.curriculum = [l.strip() for l in raw.split('\n') if l.strip()][:5]
 
         # # Print curriculum to terminal
@@ -193,23 +748,79 @@ CRITICAL RULES (KNOWLEDGE CONTAINMENT):
         # await self.ws.send_text("-" * 30 + "\r\n")
 
     async def generate_test_bank(self):
-        await self.print_system("Generating Exam Questions...")
+        """
+        Streams the test bank under a strict schema and keeps each question as soon as it
+        parses and validates, so the exam can start at EXAM_SIZE. Malformed or repeated items
+        (or the ones lost to a cut-off stream) are regenerated afterwards, in one call per round.
+        """
+        self.test_questions = []
+        parser = QuestionStream()
+        malformed = 0
+
+        def on_delta(delta):
+            nonlocal malformed
+            for item in parser.feed(delta):
+                question = parse_question(item)
+                if question:
+                    self._add_question(question)
+                else:
+                    malformed += 1
+
         prompt = f"""\
 Topic: {self.topic}
 Curriculum: {json.dumps(self.curriculum)}
-Generate 10 open-ended test questions.
-Output JSON: {{ "questions": [ {{ "difficulty": "...", "question": "...", "std_answer": "..." }} ] }}
+Generate {TEST_BANK_SIZE} open-ended test questions.
+Output JSON: {{ "questions": [ {{ "difficulty": "easy, medium or hard", "question": "...", "std_answer": "..." }} ] }}
 """
         messages = [{"role": "user", "content": prompt}]
-        json_str = await self._call_llm(messages, json_mode=True)
-        try:
-            data = json.loads(json_str)
-            self.test_questions = data.get("questions", [])
-        except: 
-            self.test_questions = []
+        await self._call_llm(messages, json_schema=TEST_BANK_SCHEMA, stream=True, site="test_bank", on_delta=on_delta)
+
+        for _ in range(TEST_BANK_REGENERATE_ROUNDS):
+            missing = TEST_BANK_SIZE - len(self.test_questions)
+            if missing <= 0:
+                break
+            print(f"Test bank: {len(self.test_questions)} valid, {malformed} malformed, regenerating {missing}")
+            malformed = await self._regenerate_questions(missing)
+
+    async def _regenerate_questions(self, count):
+        """
+        One call for all `count` missing questions, so they can't repeat each other.
+        Returns how many came back malformed.
+        """
+        prompt = f"""\
+Topic: {self.topic}
+Curriculum: {json.dumps(self.curriculum)}
+Already asked: {json.dumps([q["question"] for q in self.test_questions])}
+Generate {count} more open-ended test questions, different from the ones already asked and from each other.
+Output JSON: {{ "questions": [ {{ "difficulty": "easy, medium or hard", "question": "...", "std_answer": "..." }} ] }}
+"""
+        json_str = await self._call_llm(
+            [{"role": "user", "content": prompt}], json_schema=TEST_BANK_SCHEMA, site="test_bank"
+        )
+        malformed = 0
+        for item in QuestionStream().feed(json_str):
+            question = parse_question(item)
+            if not question:
+                malformed += 1
+            elif len(self.test_questions) < TEST_BANK_SIZE:
+                self._add_question(question)
+        return malformed
+
+    def _add_question(self, question):
+        """
+        Returns False for a repeat of a question we already have.
+        """
+        if any(q["question"] == question["question"] for q in self.test_questions):
+            return False
+        self.test_questions.append(question)
+        if len(self.test_questions) >= EXAM_SIZE:
+            self.questions_ready.set()
+        return True
 
     # --- GAMEPLAY FUNCTIONS ---
 
+    @timed(PHASE_SECONDS, phase="trigger_random_event")
+    @traced("trigger_random_event")
     async def trigger_random_event(self):
         if self.is_asleep or self.alien_countdown >= 0: return 
         if random.random() > 0.3: return 
@@ -225,9 +836,7 @@ Output JSON: {{ "questions": [ {{ "difficulty": "...", "question": "...", "std_a
         elif event == "MISCONCEPTION":
             if not self.knowledge_ledger: return
             idx = random.randint(0, len(self.knowledge_ledger)-1)
-            prompt = f"Rewrite this to be WRONG (Only respond with the rewritten note): '{self.knowledge_ledger[idx]}'"
-            bad_note = await self._call_llm([{"role": "user", "content": prompt}])
-            self.knowledge_ledger[idx] = bad_note
+            self._spawn(self._corrupt_note(self.knowledge_ledger[idx]))
             await self.print_event("The student started using reddit in class! (Memory corrupted)")
         
         elif event == "DOG":
@@ -239,7 +848,7 @@ Output JSON: {{ "questions": [ {{ "difficulty": "...", "question": "...", "std_a
             indices_to_replace = random.sample(range(len(words)), num_to_replace)
             for i in indices_to_replace:
                 words[i] = "woof"
-            self.knowledge_ledger[idx] = " ".join(words)
+            self.replace_note(corrupted_note, " ".join(words))
             await self.print_event("A dog ran by and barked at the student! The woofs lingers...")
             
         elif event == "ALIEN":
@@ -255,32 +864,131 @@ Output JSON: {{ "questions": [ {{ "difficulty": "...", "question": "...", "std_a
                 # 1. Grab a random subset of notes (2-4 items) to force a connection between them
                 subset_size = min(4, len(self.knowledge_ledger))
                 notes_subset = random.sample(self.knowledge_ledger, subset_size)
-                
-                # 2. The upgraded prompt
-                prompt = f"""
-                You are a student having a sudden 'Aha!' moment.
-                
-                YOUR CURRENT NOTES (FRAGMENTS):
-                {json.dumps(notes_subset)}
-                
-                YOUR PERSONA: {self.persona}
-                
-                TASK:
-                Look at these disjointed facts and find a deeper connection, pattern, or rule that ties them together.
-                Create a new "Epiphany Note" that combines them into a smarter insight.
-                
-                RESTRICTIONS:
-                - Do NOT simply list the facts again.
-                - The new note must be a synthesis (e.g., "Wait, so X implies Y because of Z!")
-                - Keep it under 20 words.
-                - It MUST sound like your Persona wrote it.
-                - Respond only with the new note string.
-                """
-                good_note = await self._call_llm([{"role": "user", "content": prompt}])
-                self.knowledge_ledger.append(good_note)
+                self._spawn(self._epiphany(notes_subset))
                 await self.print_event("EUCALYPTUS! Or is it eureka? Either way, the student had an epiphany and connected the dots.")
 
-    async def process_learning(self, teacher_input_text):
+    # --- BACKGROUND EVENT EFFECTS ---
+    # The banner shows right away; the LLM part lands in the ledger whenever it's done.
+
+    def _spawn(self, coro, event_effect=True):
+        """
+        Runs work off the turn's critical path. Tracked so the session can cancel it;
+        event effects are also waited for by the exam.
+        """
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        if event_effect:
+            self.event_effects.add(task)
+        task.add_done_callback(self._background_done)
+        return task
+
+    def _background_done(self, task):
+        self.background_tasks.discard(task)
+        self.event_effects.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"Background task failed: {task.exception()!r}")
+
+    async def _corrupt_note(self, note):
+        prompt = f"Rewrite this to be WRONG (Only respond with the rewritten note): '{note}'"
+        bad_note = await self._call_llm([{"role": "user", "content": prompt}], site="misconception")
+        if not bad_note:
+            return
+        # Notes may have been appended (or the dog got to this one) while we waited,
+        # so find the note by value rather than trusting the old index
+        self.replace_note(note, bad_note)
+
+    async def _epiphany(self, notes_subset):
+        # 2. The upgraded prompt
+        prompt = f"""
+        You are a student having a sudden 'Aha!' moment.
+        
+        YOUR CURRENT NOTES (FRAGMENTS):
+        {json.dumps(notes_subset)}
+        
+        YOUR PERSONA: {self.persona}
+        
+        TASK:
+        Look at these disjointed facts and find a deeper connection, pattern, or rule that ties them together.
+        Create a new "Epiphany Note" that combines them into a smarter insight.
+        
+        RESTRICTIONS:
+        - Do NOT simply list the facts again.
+        - The new note must be a synthesis (e.g., "Wait, so X implies Y because of Z!")
+        - Keep it under 20 words.
+        - It MUST sound like your Persona wrote it.
+        - Respond only with the new note string.
+        """
+        good_note = await self._call_llm([{"role": "user", "content": prompt}], site="eureka")
+        if good_note:
+            self.add_note(good_note)
+
+    # --- NOTEBOOK COMPACTION ---
+
+    def add_note(self, note):
+        self.raw_notes.append(note)
+        duplicate = self.note_index.near_duplicate(self.knowledge_ledger, note, NOTE_DEDUP_SIMILARITY)
+        if duplicate is not None:
+            # Same fact again: keep the newer wording, at the end with the recent notes
+            self.knowledge_ledger.remove(duplicate)
+            NOTES_COMPACTED.inc(stage="dedup")
+        self.knowledge_ledger.append(note)
+
+        self.notes_since_consolidation += 1
+        if NOTE_CONSOLIDATE_EVERY and self.notes_since_consolidation >= NOTE_CONSOLIDATE_EVERY:
+            self.notes_since_consolidation = 0
+            # Tidying up can finish whenever, the exam doesn't wait for it
+            self._spawn(self._consolidate_notes(), event_effect=False)
+
+    def replace_note(self, old, new):
+        """
+        Corruptions hit the working notebook, and the raw note too if it's still the same text.
+        """
+        if old in self.knowledge_ledger:
+            self.knowledge_ledger[self.knowledge_ledger.index(old)] = new
+        if old in self.raw_notes:
+            self.raw_notes[self.raw_notes.index(old)] = new
+
+    async def _consolidate_notes(self):
+        notes = list(self.knowledge_ledger)
+        if len(notes) < 2:
+            return
+        prompt = f"""\
+You are the internal brain of a student tidying up their notebook.
+Persona: {self.persona}.
+
+NOTEBOOK (oldest first):
+{json.dumps(notes)}
+
+TASK:
+Rewrite the notebook as a shorter list of notes.
+
+RULES:
+- If a later note corrects an earlier one ("Correction: X is actually Y"), keep only the corrected fact.
+- Merge notes that say the same thing into one.
+- Keep every other fact, even if it looks wrong. DO NOT fix mistakes, typos or odd words (like "woof").
+- Keep your persona's style. DO NOT use outside knowledge or add anything new.
+- Keep the original order.
+
+Output JSON: {{ "notes": ["..."] }}
+"""
+        json_str = await self._call_llm([{"role": "user", "content": prompt}], json_mode=True, site="consolidate")
+        try:
+            merged = [str(n).strip() for n in json.loads(json_str).get("notes", []) if str(n).strip()]
+        except (json.JSONDecodeError, AttributeError):
+            return
+        if not merged or len(merged) > len(notes):
+            return
+        if self.knowledge_ledger[:len(notes)] != notes:
+            # A corruption landed while we were rewriting; don't undo it, try again later
+            return
+        NOTES_COMPACTED.inc(len(notes) - len(merged), stage="consolidate")
+        # Notes written while we waited go after the merged ones
+        self.knowledge_ledger = merged + self.knowledge_ledger[len(notes):]
+
+    async def check_attention(self, teacher_input_text):
+        """
+        Sleep / attention mechanics. Returns "ASLEEP", "SKIP" (no note this turn) or "LEARN".
+        """
         # 1. Mechanics
         text_content = teacher_input_text.upper()
         
@@ -290,7 +998,7 @@ Output JSON: {{ "questions": [ {{ "difficulty": "...", "question": "...", "std_a
                 self.is_asleep = False
                 self.attention_span = 50
                 await self.print_system("The student wakes up, groggy.")
-                return None
+                return "SKIP"
             else:
                 return "ASLEEP"
 
@@ -304,152 +1012,329 @@ Output JSON: {{ "questions": [ {{ "difficulty": "...", "question": "...", "std_a
 
         # Fail state: Attention too low
         if self.attention_span < 20: 
-            return None
-
-        # 2. Prepare the "Notebook Context"
-        notebook_context = "\n".join([f"- {note}" for note in self.knowledge_ledger]) if self.knowledge_ledger else "(Notebook is empty)"
-
-        prompt = f"""\
-You are the internal brain of a student taking notes. 
-Persona: {self.persona}.
-Current Attention: {self.attention_span}%.
-
-YOUR CURRENT NOTEBOOK:
-{notebook_context}
+            return "SKIP"
+        return "LEARN"
 
-TEACHER'S INPUT:
-{teacher_input_text}
-
-TASK:
-Write the NEXT LINE for your notebook based on the teacher's input.
+    def relevant_notes(self, query):
+        """
+        The notes a prompt about `query` gets to see, in notebook order.
+        """
+        if NOTEBOOK_CONTEXT == "all":
+            return self.knowledge_ledger
+        return self.note_index.search(self.knowledge_ledger, query, NOTEBOOK_TOP_K)
 
-RULES:
-- Always follow your persona. 
-    - Your note should follow your persona's style
-    - Your understanding may be limited based on your persona.
-    - If you are not supposed to understand, write a confused note or even write incorrect information on purpose.
-- Take notes ONLY on what the teacher JUST SAID. DO NOT use outside knowledge.
-- Take into account your ATTENTION SPAN:
-- If attention < 40%, you may be confused and write a confused note.
-- If the teacher is correcting a previous fact, write a note like: "Correction: [Old Fact] is actually [New Fact]."
-- If the teacher is adding new info, just write the fact.
-- If you are confused (low attention), write a confused note.
-- DO NOT use outside knowledge. Only write what the teacher just said.
-- Return ONLY the short note string.
-"""
-        
-        messages = [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": teacher_input_text}
-        ]
+    @timed(PHASE_SECONDS, phase="process_learning")
+    @traced("process_learning")
+    async def write_note(self, teacher_input_text):
+        # Static rules first, notebook and input last (see app/prompts.py)
+        messages = note_messages(
+            self.persona, self.attention_span, self.relevant_notes(teacher_input_text), teacher_input_text
+        )
         
         # Stateless call (the "brain" processing the input)
-        note = await self._call_llm(messages)
+        note = await self._call_llm(messages, site="note")
         
         if "NOTHING" in note or len(note) < 3: 
             return None
             
         return note
 
-    async def chat_with_student(self, teacher_input_text, new_knowledge_note):
-        if not self.conversation_history:
-            await self.init_student_conversation()
+    def _history_messages(self):
+        """
+        System prompt + rolling summary (if any) + the verbatim recent turns.
+        """
+        messages = self.conversation_history[:1]
+        if self.history_summary:
+            messages.append({"role": "system", "content": f"[EARLIER IN THIS LESSON]\n{self.history_summary}"})
+        return messages + self.conversation_history[1:]
 
-        if new_knowledge_note == "ASLEEP":
-            return "Zzzzz... (snore)..."
+    async def _summarize_history(self):
+        """
+        Folds the oldest turns into history_summary once the conversation is over budget.
+        Runs in the background after the reply has been sent.
+        """
+        turns = self.conversation_history[1:]
+        char_budget, keep_turns = HISTORY_CHAR_BUDGET, HISTORY_KEEP_TURNS
+        if "short_history" in self.budget_steps():
+            char_budget, keep_turns = HISTORY_CHAR_BUDGET // 4, 1
+        if sum(len(m["content"]) for m in turns) <= char_budget:
+            return
+        old_turns = turns[:len(turns) - keep_turns * 2]
+        if not old_turns:
+            return
 
-        current_knowledge = "\n".join(self.knowledge_ledger) if self.knowledge_ledger else "(Notebook is empty)"
-        
-        state_msg = f"""
-[INTERNAL STATE]
-Attention Span: {self.attention_span}%
+        transcript = "\n".join(
+            f"{'TEACHER' if m['role'] == 'user' else 'YOU'}: {m['content']}" for m in old_turns
+        )
+        prompt = f"""\
+You are a student summarizing your own lesson so far.
 
-[MENTAL NOTEBOOK - THIS IS ALL YOU KNOW]
-{current_knowledge}
+PREVIOUS SUMMARY:
+{self.history_summary or "(none)"}
 
-[JUST LEARNED]
-You just wrote down: "{new_knowledge_note}"
+NEW PART OF THE CONVERSATION:
+{transcript}
 
-[INSTRUCTION]
-Reply to the teacher's last message.
-- If the teacher mentioned something NOT in your [Mental Notebook], you represent a student who does NOT understand it yet.
-- Do NOT explain the concept back to the teacher like an expert.
-- React naturally (e.g., "Oh okay," "Wait, what does emergent mean?", "Cool.")
+TASK:
+Write an updated summary, in first person, under 120 words.
+- Keep what the teacher taught you, what you asked, and what confused you.
+- Do NOT add outside knowledge.
+- Respond only with the summary.
 """
+        summary = await self._call_llm([{"role": "user", "content": prompt}], site="summary")
+        if not summary.strip():
+            # Provider trouble, try again after the next turn
+            return
+
+        # Only appends happen while we wait, so the old turns are still at the front
+        del self.conversation_history[1:1 + len(old_turns)]
+        self.history_summary = summary.strip()
+        self.folded_chars += sum(len(m["content"]) for m in old_turns)
+
+    @timed(PHASE_SECONDS, phase="chat_with_student")
+    @traced("chat_with_student")
+    async def chat_with_student(self, teacher_input_text, new_knowledge_note, note_pending=False):
+        """
+        note_pending: the note for this turn is still being written (pipelined turns),
+        so the reply goes off the pre-turn notebook plus what the teacher just said.
+        """
+        if not self.conversation_history:
+            await self.init_student_conversation()
+
+        # The summary runs at BACKGROUND priority and can sit in the scheduler queue for a
+        # while; the reply doesn't wait for it, it just goes out unfolded this turn
+        if self.summary_task and self.summary_task.done():
+            self.summary_task.result()
+            self.summary_task = None
+
+        if new_knowledge_note == "ASLEEP":
+            snore = "Zzzzz... (snore)..."
+            await self.ws.send_text(snore)
+            return snore
+
+        if note_pending:
+            just_learned = f'The teacher just said: "{teacher_input_text}" (you are still writing it down)'
+        else:
+            just_learned = f'You just wrote down: "{new_knowledge_note}"'
+        state_msg = chat_turn_state(self.attention_span, self.relevant_notes(teacher_input_text), just_learned)
         
         # Add system instruction for this specific turn state
-        turn_messages = self.conversation_history + [
+        new_turn = [
             {"role": "system", "content": state_msg},
             {"role": "user", "content": teacher_input_text}
         ]
+        if self.student_conversation_id or self.student_response_id:
+            # The server already has the history, only upload the new turn
+            turn_messages = new_turn
+        elif CONVERSATION_STATE == "previous_response":
+            # First turn of the chain: the system prompt goes over once
+            turn_messages = self.conversation_history[:1] + new_turn
+        else:
+            turn_messages = self._history_messages() + new_turn
+
+        CHAT_PROMPT_CHARS.observe(sum(len(m["content"]) for m in turn_messages))
+        if self.folded_chars:
+            # A summary can come out longer than a few short folded turns; that saves nothing
+            CHAT_HISTORY_SAVED_CHARS.observe(max(0, self.folded_chars - len(self.history_summary)))
         
-        response_text = await self._call_llm(turn_messages)
+        # Streams the reply into the terminal as it is generated
+        meta = {}
+        self.reply_task = asyncio.create_task(self._call_llm(
+            turn_messages,
+            stream=True,
+            site="chat",
+            conversation_id=self.student_conversation_id,
+            previous_response_id=self.student_response_id,
+            meta=meta,
+        ))
+        try:
+            response_text = await self.reply_task
+            # Canned / degraded replies have no id; the chain stays on the last real response
+            if CONVERSATION_STATE == "previous_response" and meta.get("id"):
+                self.student_response_id = meta["id"]
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise  # the whole session is going away, not just this reply
+            # Interrupted by the teacher: keep what was already on screen. The provider
+            # never finished this response, so previous_response mode stays on the last one
+            LLM_CALLS.inc(site="chat", outcome="interrupted")
+            response_text = "".join(meta.get("chunks", [])).strip()
+            await self.ws.send_text(f"{RED}^C{RESET}")
+        finally:
+            self.reply_task = None
         
         # Update history (keep it simple for now, append user/assistant)
         self.conversation_history.append({"role": "user", "content": teacher_input_text})
         self.conversation_history.append({"role": "assistant", "content": response_text})
+        if not (self.student_conversation_id or self.student_response_id) and not self.summary_task:
+            self.summary_task = asyncio.create_task(self._summarize_history())
         
-        return response_text.replace("\n", "\r\n").strip()
+        return response_text
 
-    async def run_quiz(self):
-        self.attempts_left -= 1
-        await self.print_system("\r\n--- FINAL EXAM INITIATED ---")
+    def _exam_messages(self, q):
+        # We aggressively constrain the model to ONLY use the provided text (see app/prompts.py)
+        return exam_messages(self.persona, self.relevant_notes(q['question']), q['question'])
+
+    async def _grade_answer(self, q, student_ans):
+        """
+        The Teacher AI grades one answer. Returns True on PASS.
+        """
+        messages = grade_messages(q['question'], q['std_answer'], student_ans)
+        grade = await self._call_llm(messages, site="grade")
+        return "PASS" in grade.upper()
+
+    async def _grade_batch(self, items):
+        """
+        Grades every (question, student answer) pair in a single JSON-mode call.
+        Returns {index: passed} for the items the model gave a usable verdict for.
+        """
+        payload = [
+            {"id": i, "question": q['question'], "std_answer": q['std_answer'], "student_answer": ans}
+            for i, (q, ans) in enumerate(items)
+        ]
+        messages = grade_batch_messages(json.dumps(payload))
+        json_str = await self._call_llm(messages, json_mode=True, site="grade_batch")
+        try:
+            grades = json.loads(json_str).get("grades", [])
+        except (json.JSONDecodeError, AttributeError):
+            return {}
+
+        verdicts = {}
+        for g in grades:
+            if not isinstance(g, dict):
+                continue
+            verdict = str(g.get("verdict", "")).upper()
+            if g.get("id") in range(len(items)) and verdict in ("PASS", "FAIL"):
+                verdicts[g["id"]] = verdict == "PASS"
+        return verdicts
+
+    async def _grade_one(self, q, student_ans):
+        async with self.quiz_semaphore:
+            return await self._grade_answer(q, student_ans)
+
+    async def _grade_answers(self, items):
+        """
+        Grades a list of (question, student answer) pairs, in order.
+        Clear-cut answers are graded locally (see PREGRADE), the rest by the LLM.
+        In batch mode anything the batched call couldn't grade falls back to a per-item call.
+        """
+        local = {}
+        if PREGRADE != "off":
+            for i, (q, ans) in enumerate(items):
+                passed, confidence = pregrade(ans, q['std_answer'])
+                if passed is not None:
+                    local[i] = (passed, confidence)
+
+        verdicts = {}
+        if PREGRADE == "on":
+            verdicts = {i: passed for i, (passed, confidence) in local.items() if confidence >= PREGRADE_CONFIDENCE}
+        pregrade_stats.local += len(verdicts)
+        PREGRADES.inc(len(verdicts), result="local")
+
+        pending = [i for i in range(len(items)) if i not in verdicts]
+        pregrade_stats.sent += len(pending)
+        PREGRADES.inc(len(pending), result="llm")
+        if GRADING_MODE == "batch" and len(pending) > 1:
+            batch = await self._grade_batch([items[i] for i in pending])
+            verdicts.update((pending[j], passed) for j, passed in batch.items())
+            if len(batch) < len(pending):
+                print(f"Batch grading returned {len(batch)}/{len(pending)} verdicts, grading the rest one by one")
+
+        missing = [i for i in pending if i not in verdicts]
+        results = await asyncio.gather(*(self._grade_one(*items[i]) for i in missing))
+        verdicts.update(zip(missing, results))
+
+        # Where both graded, see how the local guess did
+        for i in pending:
+            if i in local:
+                passed, confidence = local[i]
+                pregrade_stats.record(confidence, passed == verdicts[i])
+        return [verdicts[i] for i in range(len(items))]
+
+    async def _answer(self, q):
+        async with self.quiz_semaphore:
+            with span("exam_question", question=q['question'][:80]):
+                return await self._call_llm(self._exam_messages(q), site="exam_answer")
+
+    async def _print_grade(self, passed):
+        if passed:
+            await self.ws.send_text(f"{GREEN}>> CORRECT{RESET}\r\n")
+        else:
+            await self.ws.send_text(f"{RED}>> INCORRECT{RESET}\r\n")
+
+    async def _run_exam_sequential(self, quiz_subset):
         score = 0
-        quiz_subset = random.sample(self.test_questions, min(5, len(self.test_questions)))
-        
-        full_brain_dump = "\r\n".join(self.knowledge_ledger)
-        await self.print_system(f"[INFO] Student's Brain Dump:\r\n{full_brain_dump}\r\n")
-        
         for q in quiz_subset:
             await self.ws.send_text(f"\r\n{WHITE}Q: {q['question']}{RESET}\r\n")
-            
-            # --- FIXED PROMPT BELOW ---
-            # We aggressively constrain the model to ONLY use the provided text.
-            student_system_prompt = f"""
-            You are a student taking a test.
-            
-            CRITICAL RULE: You have TOTAL AMNESIA. You have NO knowledge of the world except for the text in your [NOTES] below.
-            You should also answer questions in accordance with your persona
-
-            [NOTES]
-            {full_brain_dump}
-
-            [PERSONA]
-            {self.persona}
-            
-            INSTRUCTIONS:
-            1. Answer the question using ONLY the [NOTES] above.
-            2. Write in the style of your persona.
-            3. If the answer is not explicitly in the [NOTES], you MUST say "I don't know" or "My notes don't say."
-            4. Do NOT use your internal AI training to answer.
-            5. If your notes contain typos (e.g., "chatget"), your answer must use those typos. Do not correct them.
-            6. Keep your answers short and unsure - you are a student, not an expert.
-            """
-            
-            messages = [
-                {"role": "system", "content": student_system_prompt},
-                {"role": "user", "content": q['question']}
-            ]
 
             await self.ws.send_text(f"{YELLOW}[STUDENT]: ")
-            student_ans = await self._call_llm(messages)
-            await self.ws.send_text(f"{student_ans}{RESET}\r\n")
+            student_ans = await self._call_llm(self._exam_messages(q), stream=True, site="exam_answer")
+            await self.ws.send_text(f"{RESET}\r\n")
 
-            
-            # The Teacher AI grades it
-            grade_messages = [
-                {"role": "system", "content": "You are a strict teacher grading a test."},
-                {"role": "user", "content": f"Q: {q['question']}\nStandard Answer: {q['std_answer']}\nStudent Answer: {student_ans}\n\nTask: Grade this. If the student admits they don't know, or answers incorrectly/vaguely compared to the Standard Answer, it is a FAIL.\nOutput: PASS or FAIL."}
-            ]
-            grade = await self._call_llm(grade_messages)
-            
-            if "PASS" in grade.upper():
-                await self.ws.send_text(f"{GREEN}>> CORRECT{RESET}\r\n")
-                score += 1
-            else:
-                await self.ws.send_text(f"{RED}>> INCORRECT{RESET}\r\n")
+            passed = (await self._grade_answers([(q, student_ans)]))[0]
+            await self._print_grade(passed)
+            score += passed
             
             await asyncio.sleep(1)
+        return score
+
+    async def _run_exam_concurrent(self, quiz_subset):
+        """
+        Answers every question in parallel (capped by quiz_semaphore), grades them
+        (one batched call by default), then prints the results in question order.
+        """
+        tasks = [asyncio.create_task(self._answer(q)) for q in quiz_subset]
+        try:
+            answers = await asyncio.gather(*tasks)
+        finally:
+            # If one question blew up (or the client left), don't leave the rest running
+            for task in tasks:
+                task.cancel()
+
+        results = await self._grade_answers(list(zip(quiz_subset, answers)))
+
+        score = 0
+        for q, student_ans, passed in zip(quiz_subset, answers, results):
+            await self.ws.send_text(f"\r\n{WHITE}Q: {q['question']}{RESET}\r\n")
+            student_ans = student_ans.replace("\n", "\r\n")
+            await self.ws.send_text(f"{YELLOW}[STUDENT]: {student_ans}{RESET}\r\n")
+            await self._print_grade(passed)
+            score += passed
+        return score
+
+    @timed(PHASE_SECONDS, phase="run_quiz")
+    @traced("run_quiz")
+    async def run_quiz(self):
+        if self.setup_task and not self.questions_ready.is_set():
+            await self.print_system("Still writing the exam questions, hang on...")
+        if self.setup_task:
+            # Only the first EXAM_SIZE questions are needed, the rest keep streaming in
+            await self.questions_ready.wait()
+            if self.setup_task.done():
+                await self.setup_task
+
+        if self.event_effects:
+            # Let pending misconceptions/epiphanies land before the brain dump
+            await asyncio.gather(*self.event_effects, return_exceptions=True)
+
+        if not self.test_questions:
+            # Doesn't cost an attempt, it's our fault
+            await self.print_system("The exam questions didn't come out right. Keep teaching and try TEST again in a bit.")
+            self.questions_ready.clear()
+            self.setup_task = asyncio.create_task(self.prepare_lesson())
+            return False
+
+        self.attempts_left -= 1
+        await self.print_system("\r\n--- FINAL EXAM INITIATED ---")
+        quiz_subset = random.sample(self.test_questions, min(EXAM_SIZE, len(self.test_questions)))
+        
+        full_brain_dump = "\r\n".join(self.raw_notes)
+        await self.print_system(f"[INFO] Student's Brain Dump:\r\n{full_brain_dump}\r\n")
+        
+        if QUIZ_MODE == "sequential":
+            score = await self._run_exam_sequential(quiz_subset)
+        else:
+            score = await self._run_exam_concurrent(quiz_subset)
 
         if score >= (len(quiz_subset) - 1):
             await self.print_system(f"🎉 PASSED! You taught them well.")
@@ -458,7 +1343,58 @@ Reply to the teacher's last message.
             await self.print_system(f"❌ FAILED. Attempts left: {self.attempts_left}")
             return False
 
-    async def start(self):
+    async def run(self, resume_token=None):
+        """
+        Plays the game with read_socket running alongside. Whichever ends first ends
+        the session; cancelling the game cancels every LLM call and exam question
+        still in flight instead of letting them run (and bill) for a closed tab.
+        """
+        game = asyncio.create_task(self.start(resume_token))
+        reader = asyncio.create_task(self.read_socket())
+        try:
+            done, _ = await asyncio.wait({game, reader}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            game.cancel()
+            reader.cancel()
+            await asyncio.gather(game, reader, return_exceptions=True)
+        # Re-raises WebSocketDisconnect, SessionIdle, etc. for the endpoint
+        if game in done:
+            return game.result()
+        return reader.result()
+
+    async def start(self, resume_token=None):
+        # The lesson starts preparing before the first teaching turn, so the cleanup
+        # covers setup too (a tab closed mid-setup shouldn't keep generating the exam)
+        try:
+            if resume_token and await self.restore_session(resume_token):
+                await self.ws.send_text(f"{MAGENTA}Welcome back to TEACHING SIMULATOR v1.0 (Web Edition){RESET}\r\n")
+                await self.print_system(f"Resuming your lesson. Attempts left: {self.attempts_left}")
+                if len(self.test_questions) < EXAM_SIZE:
+                    # The exam wasn't ready when the connection dropped
+                    self.setup_task = asyncio.create_task(self.prepare_lesson())
+            else:
+                await self.new_game()
+
+            # Hidden control message: the client keeps the token and sends it back on reconnect
+            await self.ws.send_text(f"__SESSION__:{self.session_token}")
+
+            await self.ws.send_text("\r\n" + "="*40 + "\r\n")
+            await self.ws.send_text(f"TOPIC: {self.topic}\r\n")
+            await self.ws.send_text("COMMANDS: /image <url>, TEST, QUIT, Ctrl+C (cut the student off)\r\n")
+
+            await self.teaching_loop()
+        finally:
+            for task in (self.setup_task, self.summary_task, *self.background_tasks):
+                if task and not task.done():
+                    task.cancel()
+
+        # Game over for real, nothing to resume
+        self.finished = True
+        await asyncio.to_thread(session_store.delete, self.session_token)
+        await self.ws.send_text("__SESSION_END__")
+        await self.ws.send_text(f"\r\n{MAGENTA}GAME OVER. REFRESH TO RESTART.{RESET}\r\n")
+
+    async def new_game(self):
         await self.ws.send_text(f"{MAGENTA}Welcome to TEACHING SIMULATOR v1.0 (Web Edition){RESET}\r\n")
 
         await self.print_system(
@@ -474,20 +1410,105 @@ Reply to the teacher's last message.
             + f"- The student has {self.attempts_left} attempts to pass the exam.\r\n"
             + "- The student must achieve at least 4/5 correct to pass.\r\n"
             + "- You can attach images using /image <url> (...I think)\r\n\n"
-            + "COMMANDS: /image <url>, TEST, QUIT\r\n"
+            + "COMMANDS: /image <url>, TEST, QUIT, Ctrl+C (cut the student off)\r\n"
             + "========================================"
         )
         
         await self.select_persona()
-        await self.set_curriculum()
-        await self.generate_test_bank()
+        await self.select_topic()
+        self.session_token = new_resume_token()
+        self.setup_task = asyncio.create_task(self.prepare_lesson())
         await self.init_student_conversation()
-        
-        await self.ws.send_text("\r\n" + "="*40 + "\r\n")
-        await self.ws.send_text(f"TOPIC: {self.topic}\r\n")
-        await self.ws.send_text("COMMANDS: /image <url>, TEST, QUIT\r\n")
 
-        
+    # --- TOKEN BUDGETS ---
+
+    def spend(self, usage):
+        self.tokens_used["input"] += usage.input_tokens
+        self.tokens_used["output"] += usage.output_tokens
+        if IP_TOKEN_BUDGET:
+            # Only keep player IPs around when there is a budget to enforce
+            ip_budgets.add(self.client_ip, usage.input_tokens, usage.output_tokens)
+
+    def budget_fraction(self):
+        """
+        How far along the tighter of the session and IP budgets this session is.
+        """
+        fractions = [ip_budgets.fraction(self.client_ip)]
+        if SESSION_TOKEN_BUDGET:
+            fractions.append(sum(self.tokens_used.values()) / SESSION_TOKEN_BUDGET)
+        return max(fractions)
+
+    def budget_steps(self):
+        return active_steps(self.budget_fraction(), BUDGET_STEPS)
+
+    async def check_budget(self):
+        """
+        Tells the player about new degradation steps. Returns False once the game has to stop.
+        """
+        messages = {
+            "short_history": "Your student's memory of the conversation is getting shorter (token budget).",
+            "small_model": "Your student is getting tired and switched to a smaller brain (token budget).",
+            "stop": "Your student has run out of tokens for today. Class dismissed!",
+        }
+        steps = self.budget_steps()
+        for step in steps:
+            if step not in self.budget_announced:
+                self.budget_announced.append(step)
+                BUDGET_STEPS_TAKEN.inc(step=step)
+                await self.print_system(messages[step])
+        return "stop" not in steps
+
+    def budget_stats(self):
+        return {
+            # /stats is public: no resume token (it's the key to the saved game) and no raw IP
+            "session": self.stats_id,
+            "ip": ip_label(self.client_ip) if IP_TOKEN_BUDGET else None,
+            "input_tokens": self.tokens_used["input"],
+            "output_tokens": self.tokens_used["output"],
+            "fraction": round(self.budget_fraction(), 3),
+            "steps": self.budget_steps(),
+        }
+
+    # --- SESSION SNAPSHOTS ---
+
+    SNAPSHOT_FIELDS = (
+        "session_token", "topic", "curriculum", "test_questions", "knowledge_ledger", "raw_notes",
+        "notes_since_consolidation", "tokens_used", "budget_announced",
+        "attention_span", "attempts_left", "persona", "conversation_history", "history_summary",
+        "folded_chars", "student_conversation_id", "student_response_id", "is_asleep", "alien_countdown",
+    )
+
+    def snapshot(self):
+        return {field: getattr(self, field) for field in self.SNAPSHOT_FIELDS}
+
+    async def save_session(self):
+        # Under the lock the snapshot is taken in order, so an older one can't land last
+        async with self.save_lock:
+            state_json = json.dumps(self.snapshot(), separators=(",", ":"))
+            # Rough but cheap: the serialized state is dominated by the same strings we hold in memory
+            self.memory_bytes = len(state_json)
+            SESSION_MEMORY_BYTES.observe(self.memory_bytes)
+            if not self.session_token or self.finished:
+                return
+            blob = dump_snapshot(state_json)
+            SESSION_SNAPSHOT_BYTES.observe(len(blob))
+            # SQLite commits (and waits on other workers' locks) off the event loop
+            await asyncio.to_thread(session_store.save, self.session_token, blob)
+
+    async def restore_session(self, token):
+        blob = await asyncio.to_thread(session_store.load, token)
+        state = load_snapshot(blob) if blob else None
+        if not state:
+            return False
+        for field in self.SNAPSHOT_FIELDS:
+            if field in state:
+                setattr(self, field, state[field])
+        if not self.raw_notes:
+            # Snapshot from before compaction existed
+            self.raw_notes = list(self.knowledge_ledger)
+        return True
+
+    async def teaching_loop(self):
         while self.attempts_left > 0:
             # Alien Event Logic
             if self.alien_countdown >= 0:
@@ -497,6 +1518,9 @@ Reply to the teacher's last message.
                     await self.ws.send_text(f"{RED}EARTH DESTROYED.{RESET}\r\n")
                     break
 
+            if not await self.check_budget():
+                break
+
             raw_input = await self.get_input(f"\r\n{GREEN}You: {RESET}")
             
             if raw_input.upper() == "QUIT": 
@@ -505,6 +1529,7 @@ Reply to the teacher's last message.
             if raw_input.upper() == "TEST":
                 if await self.run_quiz(): 
                     break
+                await self.save_session()
                 continue
 
             input_text = raw_input
@@ -518,16 +1543,55 @@ Reply to the teacher's last message.
                     await self.print_system("Missing URL.")
                     continue
 
-            # Event triggers BEFORE processing
-            await self.trigger_random_event()
+            await self.teach_turn(input_text)
+            await self.save_session()
 
-            new_note = await self.process_learning(input_text)
-            
-            if new_note and new_note != "ASLEEP":
-                self.knowledge_ledger.append(new_note)
+    @timed(PHASE_SECONDS, phase="turn")
+    @traced("turn")
+    async def teach_turn(self, input_text):
+        # Event triggers BEFORE processing
+        await self.trigger_random_event()
+
+        if TURN_MODE == "pipelined":
+            await self._pipelined_turn(input_text)
+            return
+
+        state = await self.check_attention(input_text)
+        if state == "LEARN":
+            new_note = await self.write_note(input_text)
+        else:
+            new_note = "ASLEEP" if state == "ASLEEP" else None
+
+        if new_note and new_note != "ASLEEP":
+            self.add_note(new_note)
 
+        await self.ws.send_text(f"{YELLOW}[STUDENT]: ")
+        await self.chat_with_student(input_text, new_note)
+        await self.ws.send_text(f"{RESET}\r\n")
+
+    async def _pipelined_turn(self, input_text):
+        """
+        Note-taking and the reply run at the same time, saving a round trip per turn.
+        The note lands in the ledger as soon as it's written.
+        """
+        state = await self.check_attention(input_text)
+        if state != "LEARN":
             await self.ws.send_text(f"{YELLOW}[STUDENT]: ")
-            response = await self.chat_with_student(input_text, new_note)
-            await self.ws.send_text(f"{response}{RESET}\r\n")
-        
-        await self.ws.send_text(f"\r\n{MAGENTA}GAME OVER. REFRESH TO RESTART.{RESET}\r\n")
\ No newline at end of file
+            await self.chat_with_student(input_text, "ASLEEP" if state == "ASLEEP" else None)
+            await self.ws.send_text(f"{RESET}\r\n")
+            return
+
+        async def commit_note():
+            note = await self.write_note(input_text)
+            if note:
+                self.add_note(note)
+
+        note_task = asyncio.create_task(commit_note())
+        try:
+            await self.ws.send_text(f"{YELLOW}[STUDENT]: ")
+            await self.chat_with_student(input_text, None, note_pending=True)
+            await self.ws.send_text(f"{RESET}\r\n")
+            # Usually done already (a note is much shorter than a reply)
+            await note_task
+        finally:
+            note_task.cancel()
\ No newline at end of file
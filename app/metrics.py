@@ -0,0 +1,195 @@
+"""
+Tiny Prometheus-style metrics (text exposition format), no client library needed.
+"""
+import functools
+import math
+import time
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._values.items()):
+            lines.extend(self._render_one(key, value))
+        return lines
+
+    def _render_one(self, key, value):
+        return [f"{self.name}{_label_str(self.labelnames, key)} {_fmt(value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state["counts"][i] += 1
+        state["sum"] += value
+        state["count"] += 1
+
+    def _render_one(self, key, state):
+        lines = [
+            f"{self.name}_bucket{_label_str(self.labelnames, key, ('le', _fmt(bound)))} {count}"
+            for bound, count in zip(self.buckets, state["counts"])
+        ]
+        lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {_fmt(state['sum'])}")
+        lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def timed(histogram, **labels):
+    """
+    Decorator for coroutines: observes how long each call took.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.monotonic() - started, **labels)
+        return wrapper
+    return decorator
+
+
+# --- THE APP'S METRICS ---
+
+registry = Registry()
+
+LLM_CALL_SECONDS = registry.histogram(
+    "llm_call_seconds",
+    "Provider latency per LLM call site and attempt outcome (ok, timeout, error or cancelled; excludes scheduler queue time)",
+    ["site", "outcome"],
+)
+LLM_QUEUE_SECONDS = registry.histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited in the scheduler queue", ["priority"]
+)
+LLM_CALLS = registry.counter("llm_calls_total", "LLM calls per call site and outcome", ["site", "outcome"])
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "Tokens from response.usage per call site (kind = input, output or cached)", ["site", "kind"]
+)
+CHAT_PROMPT_CHARS = registry.histogram(
+    "chat_prompt_chars", "Characters sent in each student chat request", buckets=(1000, 2000, 4000, 8000, 16000, 32000, 64000)
+)
+CHAT_HISTORY_SAVED_CHARS = registry.histogram(
+    "chat_history_saved_chars", "Characters per chat request saved by folding old turns into the history summary",
+    buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+PHASE_SECONDS = registry.histogram("game_phase_seconds", "Time spent in each game phase", ["phase"])
+ACTIVE_SESSIONS = registry.gauge("active_sessions", "Open WebSocket game sessions")
+WS_PENDING_SENDS = registry.gauge("ws_pending_sends", "WebSocket messages currently waiting to be sent")
+WS_SEND_SECONDS = registry.histogram(
+    "ws_send_seconds", "Time to hand one message to the WebSocket", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+)
+WS_SEND_QUEUE = registry.histogram(
+    "ws_send_queue_size", "Sends already queued on the same session when a new one starts", buckets=(0, 1, 2, 4, 8, 16, 32)
+)
+LLM_IN_FLIGHT = registry.gauge("llm_in_flight", "LLM requests currently running")
+LLM_QUEUE_DEPTH = registry.gauge("llm_queue_depth", "LLM requests waiting in the scheduler", ["priority"])
+SESSION_SNAPSHOT_BYTES = registry.histogram(
+    "session_snapshot_bytes", "Size of saved session snapshots", buckets=(1024, 4096, 16384, 65536, 262144, 1048576)
+)
+SESSION_MEMORY_BYTES = registry.histogram(
+    "session_memory_bytes", "Approximate per-session state size, measured every turn",
+    buckets=(4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+OPEN_SESSIONS_MEMORY_BYTES = registry.gauge("open_sessions_memory_bytes", "Approximate state size of all open sessions")
+SESSIONS_REJECTED = registry.counter("sessions_rejected_total", "Connections turned away because the worker was full")
+SESSIONS_IDLED = registry.counter("sessions_idled_total", "Sessions closed for being idle")
+NOTES_COMPACTED = registry.counter(
+    "notes_compacted_total", "Notes removed from working notebooks (stage = dedup or consolidate)", ["stage"]
+)
+PREGRADES = registry.counter(
+    "exam_pregrades_total", "Exam answers graded locally vs sent to the LLM grader (result = local or llm)", ["result"]
+)
+BUDGET_STEPS_TAKEN = registry.counter(
+    "budget_steps_total", "Sessions degraded by a token budget step (short_history, small_model, stop)", ["step"]
+)
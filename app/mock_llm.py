@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import re
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+CACHE_MIN_CHARS = 1024 * 4
+CACHE_STEP_CHARS = 128 * 4
+
+STUDENT_LINES = [
+    "Oh okay, I think I get it.",
+    "Wait, what does that word mean?",
+    "Cool. So is that always true?",
+    "Got it.",
+    "Hmm, can you say that again but slower?",
+    "But why though?",
+]
+
+
+class MockStream:
+    """
+    Async-iterable with close(), like openai's AsyncStream.
+    """
+
+    def __init__(self, events):
+        self.events = events
+
+    def __aiter__(self):
+        return self.events
+
+    async def close(self):
+        await self.events.aclose()
+
+
+class MockResponses:
+    def __init__(self, mock):
+        self.mock = mock
+
+    async def create(self, stream=False, **kwargs):
+        return await self.mock.create(stream=stream, **kwargs)
+
+
+class MockConversations:
+    def __init__(self, mock):
+        self.mock = mock
+
+    async def create(self, **kwargs):
+        return SimpleNamespace(id=f"conv_mock_{next(self.mock.ids)}")
+
+
+class MockAsyncOpenAI:
+    """
+    Offline stand-in for AsyncOpenAI (Responses API only), for benchmarks and load tests.
+
+    Replies are deterministic for a given prompt. Latency is time-to-first-token drawn
+    from a lognormal around `latency` seconds, then `tokens_per_sec` for the rest of
+    the reply. `failure_rate` of calls raise a connection or timeout error.
+    Prompt prefixes seen before are reported as cached tokens, roughly like the real
+    prompt cache (1024-token minimum, then 128-token steps).
+    """
+
+    def __init__(self, latency=0.8, jitter=0.4, tokens_per_sec=60, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_sec = tokens_per_sec
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.seen_prefixes = set()
+
+        self.responses = MockResponses(self)
+        self.conversations = MockConversations(self)
+
+    async def create(self, stream=False, **kwargs):
+        prompt = _prompt_text(kwargs.get("input", []))
+        text = self._reply(prompt, kwargs.get("text", {}).get("format", {}))
+        ttft = self.latency * self.rng.lognormvariate(0, self.jitter)
+        fail = self.rng.random() < self.failure_rate
+        response = _response(f"resp_mock_{next(self.ids)}", text, prompt, self._cached_tokens(prompt))
+
+        if stream:
+            return MockStream(self._stream(response, ttft, fail))
+
+        await asyncio.sleep(ttft + _token_count(text) / self.tokens_per_sec)
+        if fail:
+            raise self._failure()
+        return response
+
+    async def _stream(self, response, ttft, fail):
+        await asyncio.sleep(ttft)
+        if fail:
+            raise self._failure()
+        started = time.monotonic()
+        for i, word in enumerate(re.findall(r"\S+\s*", response.output_text)):
+            # Pace against the clock so slow consumers don't slow the "model" down
+            delay = started + (i + 1) / self.tokens_per_sec - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield SimpleNamespace(type="response.output_text.delta", delta=word)
+        yield SimpleNamespace(type="response.completed", response=response)
+
+    def _cached_tokens(self, prompt):
+        if len(self.seen_prefixes) > 200_000:
+            # Cache "expired", keeps long load tests from growing without bound
+            self.seen_prefixes.clear()
+        cached = 0
+        # ~4 chars per token, like _token_count
+        for end in range(CACHE_MIN_CHARS, len(prompt) + 1, CACHE_STEP_CHARS):
+            key = hashlib.sha256(prompt[:end].encode()).digest()
+            if key in self.seen_prefixes:
+                cached = end // 4
+            else:
+                self.seen_prefixes.add(key)
+        return cached
+
+    def _failure(self):
+        request = httpx.Request("POST", "https://mock.invalid/v1/responses")
+        if self.rng.random() < 0.5:
+            return openai.APITimeoutError(request=request)
+        return openai.APIConnectionError(request=request)
+
+    def _reply(self, prompt, response_format):
+        pick = int(hashlib.sha256(prompt.encode()).hexdigest(), 16)
+
+        if response_format.get("type") in ("json_object", "json_schema"):
+            if '"questions"' in prompt:
+                topic = _find(r"Topic: (.*)", prompt) or "the topic"
+                return json.dumps({"questions": [
+                    {
+                        "difficulty": ["easy", "medium", "hard"][i % 3],
+                        "question": f"What is fact #{i + 1} about {topic}?",
+                        "std_answer": f"Fact #{i + 1} about {topic}.",
+                    }
+                    for i in range(10)
+                ]})
+            if '"notes"' in prompt:
+                notes = json.loads(_find(r"NOTEBOOK \(oldest first\):\n(.*)", prompt) or "[]")
+                return json.dumps({"notes": list(dict.fromkeys(notes))})
+            if '"grades"' in prompt:
+                n = prompt.count('"student_answer"')
+                return json.dumps({"grades": [
+                    {"id": i, "verdict": "PASS" if (pick >> i) % 3 else "FAIL"} for i in range(n)
+                ]})
+            return "{}"
+
+        if "Output: PASS or FAIL" in prompt:
+            return "PASS" if pick % 3 else "FAIL"
+        if "Curriculum Generator." in prompt:
+            topic = _find(r"atomic facts about (.*)\.", prompt) or "the topic"
+            return "\n".join(f"{i + 1}. Fact #{i + 1} about {topic}." for i in range(5))
+        if "Rewrite this to be WRONG" in prompt:
+            return "Actually it's the exact opposite of what the teacher said."
+        if "Epiphany Note" in prompt:
+            return "Wait, so all of these are connected?!"
+        if "summarizing your own lesson" in prompt:
+            return "The teacher explained a few facts and I asked some questions."
+        if "internal brain of a student taking notes" in prompt:
+            teacher = prompt.rsplit("\n", 1)[-1]
+            return f"Teacher said: {teacher[:80]}"
+        return STUDENT_LINES[pick % len(STUDENT_LINES)]
+
+
+def _prompt_text(items):
+    if isinstance(items, str):
+        return items
+    parts = []
+    for item in items:
+        content = item.get("content", "")
+        parts.append(content if isinstance(content, str) else json.dumps(content))
+    return "\n".join(parts)
+
+
+def _find(pattern, text):
+    match = re.search(pattern, text)
+    return match.group(1).strip() if match else None
+
+
+def _token_count(text):
+    return max(1, len(text) // 4)
+
+
+def _response(response_id, text, prompt, cached_tokens=0):
+    usage = SimpleNamespace(
+        input_tokens=_token_count(prompt),
+        output_tokens=_token_count(text),
+        total_tokens=_token_count(prompt) + _token_count(text),
+        input_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+        output_tokens_details=SimpleNamespace(reasoning_tokens=0),
+    )
+    return SimpleNamespace(id=response_id, output_text=text, usage=usage)
@@ -0,0 +1,169 @@
+"""
+Prompt assembly for the student and grader calls.
+
+Providers cache the longest prompt prefix they've seen recently, so every prompt
+here is laid out the same way: static instructions first, then what is fixed for
+the session (persona, topic), then what changes every call (attention, notes,
+the teacher's input). Anything volatile near the top would make every call a miss.
+"""
+
+
+def layout(*sections):
+    """
+    Joins the non-empty sections of a prompt, in the order given.
+    """
+    return "\n\n".join(s.strip("\n") for s in sections if s) + "\n"
+
+
+# --- STUDENT CHAT ---
+
+STUDENT_INSTRUCTIONS = """\
+You are a student simulating a human learner.
+
+CRITICAL RULES (KNOWLEDGE CONTAINMENT):
+1. **TABULA RASA:** You know NOTHING about YOUR TOPIC except what is written in your [Mental Notebook].
+2. **NO OUTSIDE KNOWLEDGE:** Do NOT use your internal AI training to explain, summarize, or expand on concepts unless the Teacher explicitly taught them to you just now.
+3. **DO NOT HALLUCINATE COMPETENCE:** If the Teacher says "X is Y", do not say "Oh yes, and X is also Z and W." You don't know that yet.
+4. **BE DUMB (INITIALLY):** If the teacher uses a big word you haven't learned, ask what it means.
+5. **RESPONSE STYLE:** Short, casual, reactive. Do NOT lecture the teacher.
+
+EVERY TURN you get your [INTERNAL STATE], your [MENTAL NOTEBOOK] (this is all you know) and what you
+[JUST LEARNED], then the teacher's message. Reply to the teacher's last message.
+- If the teacher mentioned something NOT in your [Mental Notebook], you represent a student who does NOT understand it yet.
+- Do NOT explain the concept back to the teacher like an expert.
+- React naturally (e.g., "Oh okay," "Wait, what does emergent mean?", "Cool.")
+"""
+
+
+def student_system_prompt(persona, topic):
+    return layout(STUDENT_INSTRUCTIONS, f"YOUR PERSONA: {persona}\nYOUR TOPIC: {topic}")
+
+
+def chat_turn_state(attention, notes, just_learned):
+    """
+    The per-turn system message that goes right before the teacher's message.
+    """
+    return layout(
+        f"[INTERNAL STATE]\nAttention Span: {attention}%",
+        "[MENTAL NOTEBOOK - THIS IS ALL YOU KNOW]\n" + ("\n".join(notes) if notes else "(Notebook is empty)"),
+        f"[JUST LEARNED]\n{just_learned}",
+    )
+
+
+# --- NOTE-TAKING ---
+
+NOTE_INSTRUCTIONS = """\
+You are the internal brain of a student taking notes.
+
+TASK:
+Write the NEXT LINE for your notebook based on the teacher's input.
+
+RULES:
+- Always follow your persona.
+    - Your note should follow your persona's style
+    - Your understanding may be limited based on your persona.
+    - If you are not supposed to understand, write a confused note or even write incorrect information on purpose.
+- Take notes ONLY on what the teacher JUST SAID. DO NOT use outside knowledge.
+- Take into account your ATTENTION SPAN:
+- If attention < 40%, you may be confused and write a confused note.
+- If the teacher is correcting a previous fact, write a note like: "Correction: [Old Fact] is actually [New Fact]."
+- If the teacher is adding new info, just write the fact.
+- If you are confused (low attention), write a confused note.
+- DO NOT use outside knowledge. Only write what the teacher just said.
+- Return ONLY the short note string.
+"""
+
+
+def note_messages(persona, attention, notes, teacher_input):
+    notebook = "\n".join(f"- {note}" for note in notes) if notes else "(Notebook is empty)"
+    prompt = layout(
+        NOTE_INSTRUCTIONS,
+        f"Persona: {persona}.",
+        f"Current Attention: {attention}%.",
+        f"YOUR CURRENT NOTEBOOK:\n{notebook}",
+        f"TEACHER'S INPUT:\n{teacher_input}",
+    )
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": teacher_input},
+    ]
+
+
+# --- EXAM ---
+
+EXAM_INSTRUCTIONS = """\
+You are a student taking a test.
+
+CRITICAL RULE: You have TOTAL AMNESIA. You have NO knowledge of the world except for the text in your [NOTES] below.
+You should also answer questions in accordance with your persona
+
+INSTRUCTIONS:
+1. Answer the question using ONLY the [NOTES] below.
+2. Write in the style of your persona.
+3. If the answer is not explicitly in the [NOTES], you MUST say "I don't know" or "My notes don't say."
+4. Do NOT use your internal AI training to answer.
+5. If your notes contain typos (e.g., "chatget"), your answer must use those typos. Do not correct them.
+6. Keep your answers short and unsure - you are a student, not an expert.
+"""
+
+
+def exam_messages(persona, notes, question):
+    prompt = layout(EXAM_INSTRUCTIONS, f"[PERSONA]\n{persona}", "[NOTES]\n" + "\n".join(notes))
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": question},
+    ]
+
+
+# --- GRADING ---
+
+GRADER = "You are a strict teacher grading a test."
+
+
+def grade_messages(question, std_answer, answer):
+    return [
+        {"role": "system", "content": GRADER},
+        {"role": "user", "content": (
+            "Task: Grade this. If the student admits they don't know, or answers incorrectly/vaguely "
+            "compared to the Standard Answer, it is a FAIL.\nOutput: PASS or FAIL.\n\n"
+            f"Q: {question}\nStandard Answer: {std_answer}\nStudent Answer: {answer}"
+        )},
+    ]
+
+
+def grade_batch_messages(items_json):
+    return [
+        {"role": "system", "content": GRADER},
+        {"role": "user", "content": f"""\
+Task: Grade each item. If the student admits they don't know, or answers incorrectly/vaguely compared to the std_answer, it is a FAIL.
+Output JSON: {{ "grades": [ {{ "id": 0, "verdict": "PASS or FAIL" }} ] }}
+
+Items: {items_json}
+"""},
+    ]
+
+
+class PromptCacheStats:
+    """
+    Share of input tokens the provider served from its prompt cache, per call site
+    (from response.usage), to check the layout above actually pays off.
+    """
+
+    def __init__(self):
+        self.sites = {}  # site -> [input_tokens, cached_tokens]
+
+    def record(self, site, usage):
+        details = getattr(usage, "input_tokens_details", None)
+        totals = self.sites.setdefault(site, [0, 0])
+        totals[0] += usage.input_tokens
+        totals[1] += (details.cached_tokens or 0) if details else 0
+
+    def stats(self):
+        return {
+            site: {
+                "input_tokens": total,
+                "cached_tokens": cached,
+                "cached_fraction": round(cached / total, 3) if total else 0.0,
+            }
+            for site, (total, cached) in sorted(self.sites.items())
+        }
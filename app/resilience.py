@@ -0,0 +1,136 @@
+import asyncio
+import random
+import time
+from collections import defaultdict, deque
+
+import openai
+
+# Errors worth another try. Anything else (bad request, auth...) fails the same way twice.
+RETRYABLE_ERRORS = (
+    TimeoutError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+def is_retryable(exc):
+    return isinstance(exc, RETRYABLE_ERRORS)
+
+
+class LatencyTracker:
+    """
+    Rolling window of successful call latencies per call site.
+    """
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, site, seconds):
+        self.samples[site].append(seconds)
+
+    def percentile(self, site, pct):
+        """
+        Returns None until there are enough samples to trust the number.
+        """
+        samples = self.samples.get(site)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open, callers should
+    serve a canned reply instead of calling the provider. After `cooldown` seconds
+    one probe request is let through (half-open); its result closes or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def abandon_probe(self):
+        # The probe was cancelled before we learned anything, let the next call probe
+        self.probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.probing:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self.failures, "times_opened": self.times_opened}
+
+
+async def call_with_retries(attempt, retries=2, backoff=0.5, hedge_after=None, should_retry=is_retryable):
+    """
+    Runs `attempt` (a coroutine factory, which applies its own timeout) with exponential
+    backoff between retries. If hedge_after is set and the first try is still running
+    after that many seconds, a duplicate is started and whichever finishes first wins.
+    """
+    for n in range(retries + 1):
+        try:
+            return await _hedged(attempt, hedge_after)
+        except Exception as e:
+            if n == retries or not should_retry(e):
+                raise
+            delay = backoff * 2 ** n * random.uniform(0.5, 1.5)
+            print(f"LLM call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def _hedged(attempt, hedge_after):
+    if hedge_after is None:
+        return await attempt()
+
+    first = asyncio.create_task(attempt())
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=hedge_after)
+        if not done:
+            pending.add(asyncio.create_task(attempt()))
+
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
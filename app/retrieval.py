@@ -0,0 +1,114 @@
+"""
+Local BM25 index over the student's notes, so prompts can carry the notes that
+matter for the current question instead of the whole notebook. No network.
+"""
+import math
+import re
+
+TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from had has have how i if in into is it its "
+    "me my not of on or so than that the their them then there these they this to was we were "
+    "what when where which who why will with you your".split()
+)
+
+
+def tokenize(text):
+    return [t for t in TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class NoteIndex:
+    """
+    Keyed by note text. sync() only tokenizes notes it hasn't seen and drops the
+    ones that left the ledger (corrupted, merged...), so keeping it in step with a
+    growing notebook costs next to nothing per turn.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms = {}  # note -> {term: count}
+        self.lengths = {}  # note -> token count
+        self.postings = {}  # term -> set of notes containing it
+        self.total_length = 0
+
+    def add(self, note):
+        if note in self.terms:
+            return
+        counts = {}
+        for term in tokenize(note):
+            counts[term] = counts.get(term, 0) + 1
+        self.terms[note] = counts
+        self.lengths[note] = sum(counts.values())
+        self.total_length += self.lengths[note]
+        for term in counts:
+            self.postings.setdefault(term, set()).add(note)
+
+    def remove(self, note):
+        counts = self.terms.pop(note, None)
+        if counts is None:
+            return
+        self.total_length -= self.lengths.pop(note)
+        for term in counts:
+            notes = self.postings[term]
+            notes.discard(note)
+            if not notes:
+                del self.postings[term]
+
+    def sync(self, ledger):
+        current = set(ledger)
+        for note in [n for n in self.terms if n not in current]:
+            self.remove(note)
+        for note in current:
+            self.add(note)
+
+    def scores(self, query):
+        n = len(self.terms)
+        if not n:
+            return {}
+        avg_length = self.total_length / n or 1
+        scores = {}
+        for term in set(tokenize(query)):
+            notes = self.postings.get(term)
+            if not notes:
+                continue
+            idf = math.log(1 + (n - len(notes) + 0.5) / (len(notes) + 0.5))
+            for note in notes:
+                tf = self.terms[note][term]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[note] / avg_length)
+                scores[note] = scores.get(note, 0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def near_duplicate(self, ledger, note, threshold):
+        """
+        The note in `ledger` that shares the most terms with `note` (Jaccard over
+        term sets), if that overlap reaches `threshold`. Exact repeats always match.
+        """
+        self.sync(ledger)
+        if note in self.terms:
+            return note
+        terms = set(tokenize(note))
+        if not terms:
+            return None
+        candidates = set()
+        for term in terms:
+            candidates |= self.postings.get(term, set())
+        best, best_overlap = None, threshold
+        for candidate in candidates:
+            other = self.terms[candidate].keys()
+            overlap = len(terms & other) / len(terms | other)
+            if overlap >= best_overlap:
+                best, best_overlap = candidate, overlap
+        return best
+
+    def search(self, ledger, query, k):
+        """
+        The k notes of `ledger` most relevant to `query`, in notebook order.
+        Ties (including notes that match nothing) go to the most recent notes.
+        """
+        self.sync(ledger)
+        if len(ledger) <= k:
+            return list(ledger)
+        scores = self.scores(query)
+        ranked = sorted(range(len(ledger)), key=lambda i: (scores.get(ledger[i], 0), i), reverse=True)
+        return [ledger[i] for i in sorted(ranked[:k])]
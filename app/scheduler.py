@@ -0,0 +1,189 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+# Priority classes (lower goes first)
+INTERACTIVE = 0  # the teacher is staring at the screen waiting for this
+EXAM = 1
+BACKGROUND = 2  # setup, random events, summaries
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", EXAM: "exam", BACKGROUND: "background"}
+
+
+def estimate_tokens(messages):
+    """
+    Rough input token count (~4 chars per token). Good enough for rate limiting,
+    the real number from response.usage is settled after the call.
+    """
+    chars = 0
+    for m in messages:
+        content = m.get("content", "")
+        chars += len(content) if isinstance(content, str) else len(str(content))
+    return chars // 4 + 1
+
+
+class TokenBucket:
+    """
+    Refills `per_minute` units every minute, continuously. per_minute=0 means unlimited.
+    The level may go negative when a call turns out bigger than estimated; that debt
+    just delays the next caller.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """
+        Seconds until `amount` can be taken (0 if it can be taken now).
+        """
+        if not self.per_minute:
+            return 0.0
+        self._refill()
+        # Never ask for more than a full bucket, or a huge prompt would wait forever
+        amount = min(amount, self.per_minute)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.per_minute
+
+    def take(self, amount):
+        if self.per_minute:
+            self._refill()
+            self.level -= amount
+
+
+class Ticket:
+    def __init__(self, priority, tokens):
+        self.priority = priority
+        self.tokens = tokens  # estimate reserved up front
+        self.actual_tokens = None  # set by the caller from response.usage
+        self.wait_seconds = 0.0
+
+
+class LLMScheduler:
+    """
+    Process-wide admission control in front of the LLM provider.
+
+    - at most `max_in_flight` requests at once (0 = unlimited)
+    - requests-per-minute and tokens-per-minute token buckets
+    - waiting requests are served by priority class, then FIFO, but a request moves
+      up one class for every `aging` seconds it has waited, so BACKGROUND work (the
+      test bank an exam may be waiting on) can't starve under steady INTERACTIVE
+      load. aging=0 is strict priority
+    """
+
+    def __init__(self, max_in_flight=32, rpm=0, tpm=0, aging=10.0):
+        self.max_in_flight = max_in_flight
+        self.aging = aging
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+        self.in_flight = 0
+        self._queue = []  # heap of (rank, seq, future, ticket), see _rank()
+        self._seq = itertools.count()
+        self._timer = None
+
+        # Metrics
+        self.granted = 0
+        self.max_queue_depth = 0
+        self.wait_seconds = {name: 0.0 for name in PRIORITY_NAMES.values()}
+
+    @asynccontextmanager
+    async def slot(self, priority=INTERACTIVE, tokens=0):
+        ticket = await self.acquire(priority, tokens)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    async def acquire(self, priority=INTERACTIVE, tokens=0):
+        ticket = Ticket(priority, tokens)
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (self._rank(priority), next(self._seq), fut, ticket))
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+
+        started = time.monotonic()
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Granted and cancelled at the same time: hand the slot back
+                self.release(ticket)
+            raise
+
+        ticket.wait_seconds = time.monotonic() - started
+        self.wait_seconds[PRIORITY_NAMES.get(priority, str(priority))] += ticket.wait_seconds
+        return ticket
+
+    def _rank(self, priority):
+        """
+        Everything in the queue ages at the same rate, so "enqueued at t with class p"
+        ranks like a fresh request at t + p * aging, and the heap order never changes.
+        """
+        if not self.aging:
+            return (priority, 0.0)
+        return (0, time.monotonic() + priority * self.aging)
+
+    def release(self, ticket):
+        self.in_flight -= 1
+        if ticket.actual_tokens is not None:
+            # Settle the estimate against what the provider actually counted
+            self.tokens.take(ticket.actual_tokens - ticket.tokens)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._queue and (not self.max_in_flight or self.in_flight < self.max_in_flight):
+            _, _, fut, ticket = self._queue[0]
+            if fut.done():
+                # Waiter was cancelled
+                heapq.heappop(self._queue)
+                continue
+
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(ticket.tokens))
+            if wait > 0:
+                self._schedule_retry(wait)
+                return
+
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(ticket.tokens)
+            self.in_flight += 1
+            self.granted += 1
+            fut.set_result(None)
+
+    def _schedule_retry(self, delay):
+        if self._timer and not self._timer.cancelled():
+            return
+        loop = asyncio.get_running_loop()
+
+        def retry():
+            self._timer = None
+            self._dispatch()
+
+        self._timer = loop.call_later(delay, retry)
+
+    def queue_depth(self):
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for _, _, fut, ticket in self._queue:
+            if not fut.done():
+                depth[PRIORITY_NAMES.get(ticket.priority, str(ticket.priority))] += 1
+        return depth
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self.queue_depth(),
+            "max_queue_depth": self.max_queue_depth,
+            "granted": self.granted,
+            "wait_seconds": {k: round(v, 3) for k, v in self.wait_seconds.items()},
+        }
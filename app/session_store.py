@@ -0,0 +1,118 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+
+SNAPSHOT_VERSION = 1
+
+
+def new_resume_token():
+    return secrets.token_urlsafe(16)
+
+
+def dump_snapshot(state_json):
+    """
+    Game state (already serialized to JSON) -> compact bytes (zlib-compressed JSON;
+    notes and chat compress well).
+    """
+    payload = f'{{"v":{SNAPSHOT_VERSION},"state":{state_json}}}'
+    return zlib.compress(payload.encode(), 6)
+
+
+def load_snapshot(blob):
+    data = json.loads(zlib.decompress(blob))
+    if data.get("v") != SNAPSHOT_VERSION:
+        return None
+    return data["state"]
+
+
+class SessionStore:
+    """
+    Where session snapshots live between connections. Keyed by resume token.
+    """
+
+    def save(self, token, blob):
+        raise NotImplementedError
+
+    def load(self, token):
+        raise NotImplementedError
+
+    def delete(self, token):
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Single worker only: a reconnect has to land on the same process.
+    """
+
+    def __init__(self, ttl=24 * 3600):
+        self.ttl = ttl
+        self.sessions = {}  # token -> (saved_at, blob)
+
+    def save(self, token, blob):
+        self.sessions[token] = (time.time(), blob)
+
+    def load(self, token):
+        entry = self.sessions.get(token)
+        if not entry:
+            return None
+        saved_at, blob = entry
+        if time.time() - saved_at > self.ttl:
+            del self.sessions[token]
+            return None
+        return blob
+
+    def delete(self, token):
+        self.sessions.pop(token, None)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Shared by every worker on the box, so a client can resume on any of them.
+    """
+
+    def __init__(self, path, ttl=24 * 3600):
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")  # several workers write at once
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (token TEXT PRIMARY KEY, saved_at REAL NOT NULL, data BLOB NOT NULL)"
+        )
+        self.db.commit()
+        self.saves = 0
+        self.lock = threading.Lock()  # saves run in worker threads, one transaction at a time
+
+    def save(self, token, blob):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sessions (token, saved_at, data) VALUES (?, ?, ?)",
+                (token, time.time(), blob),
+            )
+            self.saves += 1
+            if self.saves % 100 == 0:
+                self.db.execute("DELETE FROM sessions WHERE saved_at < ?", (time.time() - self.ttl,))
+            self.db.commit()
+
+    def load(self, token):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT data FROM sessions WHERE token = ? AND saved_at >= ?",
+                (token, time.time() - self.ttl),
+            ).fetchone()
+        return row[0] if row else None
+
+    def delete(self, token):
+        with self.lock:
+            self.db.execute("DELETE FROM sessions WHERE token = ?", (token,))
+            self.db.commit()
+
+
+def make_session_store(kind, path, ttl):
+    if kind == "sqlite":
+        return SqliteSessionStore(path, ttl)
+    return InMemorySessionStore(ttl)
@@ -0,0 +1,97 @@
+"""
+Opt-in per-session tracing, written as Chrome trace_event JSON
+(open in chrome://tracing or https://ui.perfetto.dev).
+
+Every span is a complete ("X") event. Each asyncio task gets its own thread id
+so concurrent work shows up side by side, and span_id / parent_id in the args
+keep the tree (OpenTelemetry style) across tasks.
+"""
+import asyncio
+import functools
+import itertools
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_tracer = ContextVar("tracer", default=None)
+_parent_span = ContextVar("parent_span", default=None)
+
+
+class Tracer:
+    def __init__(self, session_id, path):
+        self.session_id = session_id
+        self.path = path
+        self.events = []
+        self.started = time.perf_counter()
+        self._ids = itertools.count(1)
+        self._tids = {}
+
+    def now_us(self):
+        return (time.perf_counter() - self.started) * 1e6
+
+    def tid(self):
+        task = asyncio.current_task()
+        key = id(task) if task else 0
+        if key not in self._tids:
+            self._tids[key] = len(self._tids) + 1
+            name = task.get_name() if task else "main"
+            self.events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": self._tids[key], "args": {"name": name}})
+        return self._tids[key]
+
+    def write(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms", "otherData": {"session": self.session_id}}, f)
+        return self.path
+
+
+def start_tracing(session_id, trace_dir):
+    """
+    Turns tracing on for the current task and every task it creates from now on.
+    """
+    path = os.path.join(trace_dir, f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{session_id}.json")
+    tracer = Tracer(session_id, path)
+    _tracer.set(tracer)
+    return tracer
+
+
+@contextmanager
+def span(name, **args):
+    tracer = _tracer.get()
+    if tracer is None:
+        yield
+        return
+
+    span_id = next(tracer._ids)
+    parent_id = _parent_span.get()
+    token = _parent_span.set(span_id)
+    tid = tracer.tid()
+    start = tracer.now_us()
+    try:
+        yield
+    finally:
+        _parent_span.reset(token)
+        tracer.events.append({
+            "name": name,
+            "ph": "X",
+            "ts": start,
+            "dur": tracer.now_us() - start,
+            "pid": 1,
+            "tid": tid,
+            "args": {"span_id": span_id, "parent_id": parent_id, **args},
+        })
+
+
+def traced(name):
+    """
+    Decorator for coroutines: wraps every call in a span.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator